@@ -0,0 +1,177 @@
+import os
+import asyncio
+import contextlib
+from typing import Dict
+from starlette.requests import Request
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+MB = 1024 * 1024
+
+# Largest accepted file per type in MB, overridden with MAX_UPLOAD_MB_<TYPE>
+UPLOAD_LIMITS_MB = {
+    'pdf': 20,
+    'image': 20,
+    'excel': 50,
+    'csv': 500,
+}
+
+# Upload bytes held by requests in progress before new uploads have to wait
+MAX_INFLIGHT_MB = int(os.getenv("MAX_INFLIGHT_MB", "256"))
+
+# Seconds a new upload waits for room in the budget before it is turned away
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "10"))
+
+# Suggested wait sent with 429 responses
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+# Requests whose body is an upload
+UPLOAD_PATH_PREFIXES = ("/api/extract", "/api/uploads/")
+
+# Requests under those prefixes without an upload body, their handler reserves the real size
+UNBUDGETED_PATH_SUFFIXES = ("/complete",)
+
+def max_upload_bytes(file_type: str) -> int:
+    """Size cap for one file of a type, the largest cap for unknown types"""
+    default = UPLOAD_LIMITS_MB.get(file_type, max(UPLOAD_LIMITS_MB.values()))
+    return int(os.getenv(f"MAX_UPLOAD_MB_{file_type.upper()}", str(default))) * MB
+
+def largest_upload_bytes() -> int:
+    return max(max_upload_bytes(file_type) for file_type in UPLOAD_LIMITS_MB)
+
+class UploadBudget:
+    """Global budget of upload bytes being processed by requests in progress
+    
+    A request reserves the size of its upload for as long as it runs. When
+    the budget is used up new requests wait up to wait_seconds for room and
+    are turned away after that. Uploads are streamed to disk, so an upload
+    larger than the whole budget reserves all of it and runs alone instead
+    of being turned away.
+    """
+    
+    def __init__(self, max_bytes: int, wait_seconds: float):
+        self.max_bytes = max_bytes
+        self.wait_seconds = wait_seconds
+        self.condition = asyncio.Condition()
+        self.in_flight_bytes = 0
+        self.in_flight_uploads = 0
+        self.queued = 0
+        self.peak_in_flight_bytes = 0
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_too_large = 0
+    
+    def fits(self, size: int) -> bool:
+        return self.in_flight_bytes + size <= self.max_bytes
+    
+    def reservation(self, size: int) -> int:
+        """Bytes of the budget an upload of size bytes holds"""
+        return min(size, self.max_bytes)
+    
+    async def acquire(self, size: int) -> bool:
+        """Reserve size bytes, False if there was no room within wait_seconds"""
+        async with self.condition:
+            if not self.fits(size):
+                self.queued += 1
+                try:
+                    await asyncio.wait_for(self.condition.wait_for(lambda: self.fits(size)), self.wait_seconds)
+                except asyncio.TimeoutError:
+                    self.rejected_busy += 1
+                    return False
+                finally:
+                    self.queued -= 1
+            
+            self.in_flight_bytes += size
+            self.in_flight_uploads += 1
+            self.peak_in_flight_bytes = max(self.peak_in_flight_bytes, self.in_flight_bytes)
+            self.admitted += 1
+            return True
+    
+    async def release(self, size: int) -> None:
+        async with self.condition:
+            self.in_flight_bytes -= size
+            self.in_flight_uploads -= 1
+            self.condition.notify_all()
+    
+    def gauges(self) -> Dict[str, int]:
+        return {
+            'budget_bytes': self.max_bytes,
+            'in_flight_bytes': self.in_flight_bytes,
+            'in_flight_uploads': self.in_flight_uploads,
+            'queued': self.queued,
+            'peak_in_flight_bytes': self.peak_in_flight_bytes,
+            'admitted': self.admitted,
+            'rejected_busy': self.rejected_busy,
+            'rejected_too_large': self.rejected_too_large,
+        }
+
+# Shared by all requests of this worker
+upload_budget = UploadBudget(MAX_INFLIGHT_MB * MB, ADMISSION_WAIT_SECONDS)
+
+def too_large(detail: str) -> JSONResponse:
+    upload_budget.rejected_too_large += 1
+    return JSONResponse(status_code=413, content={"detail": detail})
+
+def busy() -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many uploads in progress, please retry shortly"},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+@contextlib.asynccontextmanager
+async def reserved(size: int):
+    """Hold size bytes of the budget inside a request handler, for work not covered by the middleware"""
+    size = upload_budget.reservation(size)
+    if not await upload_budget.acquire(size):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many uploads in progress, please retry shortly",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    try:
+        yield
+    finally:
+        await upload_budget.release(size)
+
+class AdmissionMiddleware:
+    """Admit uploads against the byte budget before their body is read
+    
+    The reservation is the request's Content-Length, or the largest per-type
+    cap when the client streams without one, at most the whole budget.
+    Per-type caps are checked again once the file name is known (see
+    save_upload_file). Completing a chunked upload is left to its handler,
+    which reserves the assembled file's size with reserved.
+    
+    A plain ASGI middleware rather than BaseHTTPMiddleware, which hides the
+    client's disconnect from the endpoint (see deadlines.run_until_abandoned).
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        request = Request(scope)
+        path = request.url.path
+        if (request.method not in ("POST", "PUT") or not path.startswith(UPLOAD_PATH_PREFIXES)
+                or path.endswith(UNBUDGETED_PATH_SUFFIXES)):
+            return await self.app(scope, receive, send)
+        
+        content_length = request.headers.get("content-length")
+        size = int(content_length) if content_length and content_length.isdigit() else largest_upload_bytes()
+        if size == 0:
+            return await self.app(scope, receive, send)
+        
+        if size > largest_upload_bytes():
+            return await too_large(f"Upload of {size} bytes is larger than the server accepts")(scope, receive, send)
+        
+        size = upload_budget.reservation(size)
+        if not await upload_budget.acquire(size):
+            return await busy()(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await upload_budget.release(size)
@@ -0,0 +1,60 @@
+import math
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# Values whose scaled fraction is this close to .5 are rounded by Python instead
+TIE_TOLERANCE = 1e-6
+
+# Above this the scaled value has no fraction left to round
+EXACT_LIMIT = 2.0 ** 52
+
+# Plain Python numbers only: bools aren't amounts, and numpy scalars round differently
+COLUMN_TYPES = {int, float, type(None)}
+
+def round2(values: np.ndarray) -> np.ndarray:
+    """Round to 2 decimals with the same result as Python's round(x, 2)
+    
+    Python rounds the exact decimal value of the float, while scaling by 100
+    can land a value just below .5 exactly on it. Those near-ties, and values
+    too large to scale, are re-rounded one by one with Python's round.
+    """
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = values * 100
+        rounded = np.rint(scaled) / 100
+        
+        fraction = np.abs(scaled - np.floor(scaled) - 0.5)
+        unsure = np.flatnonzero((fraction < TIE_TOLERANCE) | (np.abs(scaled) >= EXACT_LIMIT))
+    
+    for i in unsure.tolist():
+        if math.isfinite(values[i]):
+            rounded[i] = round(float(values[i]), 2)
+    return rounded
+
+def column(rows: List[Dict[str, Any]], field: str) -> Optional[np.ndarray]:
+    """Values of a field as a float array with missing and None as NaN
+    
+    Returns None when any value isn't a plain number or None.
+    """
+    values = [row.get(field) for row in rows]
+    if not set(map(type, values)) <= COLUMN_TYPES:
+        return None
+    return np.array(values, dtype=float)
+
+def present(rows: List[Dict[str, Any]], field: str) -> np.ndarray:
+    """Mask of rows where the field exists (even if None)"""
+    return np.fromiter((field in row for row in rows), dtype=bool, count=len(rows))
+
+def not_none(rows: List[Dict[str, Any]], field: str) -> np.ndarray:
+    """Mask of rows where the field exists and isn't None (NaN counts as a value)"""
+    return np.fromiter((row.get(field) is not None for row in rows), dtype=bool, count=len(rows))
+
+def write_column(rows: List[Dict[str, Any]], field: str, values: np.ndarray, mask: Optional[np.ndarray] = None) -> None:
+    """Store values back into the row dicts, only where mask is set"""
+    if mask is None:
+        for row, value in zip(rows, values.tolist()):
+            row[field] = value
+        return
+    
+    indices = np.flatnonzero(mask)
+    for i, value in zip(indices.tolist(), values[indices].tolist()):
+        rows[i][field] = value
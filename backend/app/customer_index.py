@@ -0,0 +1,220 @@
+import os
+import re
+import uuid
+import sqlite3
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional
+from .storage import DATA_DIR
+
+# Names the extractors make up when a document has none, e.g. "Customer for INV-12"
+PLACEHOLDER_NAME = re.compile(r'^customer for\b', re.IGNORECASE)
+
+# Titles and company suffixes that don't tell customers apart
+NAME_NOISE = {'mr', 'mrs', 'ms', 'dr', 'm/s', 'ms.', 'messrs', 'pvt', 'private', 'ltd', 'limited', 'inc', 'llp', 'co'}
+
+# How similar two names in the same block must be to count as one customer
+NAME_MATCH_RATIO = float(os.getenv("CUSTOMER_NAME_MATCH_RATIO", "0.9"))
+
+def normalize_name(name: Optional[str]) -> str:
+    """Lowercase name without punctuation, titles or company suffixes"""
+    if not name:
+        return ''
+    tokens = re.sub(r'[^\w/]+', ' ', str(name).lower()).split()
+    return ' '.join(token for token in tokens if token not in NAME_NOISE)
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Digits only, without the country code"""
+    digits = re.sub(r'\D', '', str(phone or ''))
+    return digits[-10:] if len(digits) >= 7 else ''
+
+def normalize_email(email: Optional[str]) -> str:
+    email = str(email or '').strip().lower()
+    return email if '@' in email else ''
+
+def name_block(normalized_name: str) -> str:
+    """Cheap blocking key, only names in the same block are compared for typos"""
+    return ''.join(sorted(normalized_name.split()))[:4]
+
+def exact_keys(name: Optional[str], phone: Optional[str], email: Optional[str]) -> List[str]:
+    """Lookup keys of a customer, strongest first"""
+    keys = []
+    if normalize_email(email):
+        keys.append(f"email:{normalize_email(email)}")
+    if normalize_phone(phone):
+        keys.append(f"phone:{normalize_phone(phone)}")
+    if normalize_name(name):
+        keys.append(f"name:{normalize_name(name)}")
+    return keys
+
+def similar_names(a: str, b: str) -> bool:
+    # Names differing only in numbers are different customers ("Shop 12", "Shop 13")
+    if re.findall(r'\d+', a) != re.findall(r'\d+', b):
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= NAME_MATCH_RATIO
+
+class CustomerIndex:
+    """Persistent customer identities shared by all uploads
+    
+    Customers are matched on normalized email, phone and name through keyed
+    lookups, then on similar names within a small block. Nameless customers
+    (placeholders like "Customer for INV-12") are also matched on the serial
+    numbers of their invoices; real names never are, since serial numbers
+    repeat across vendors. Each identity keeps its purchases by invoice serial
+    number, so an invoice seen again in any upload (the same file, an
+    overlapping export, its item report) replaces its amount instead of being
+    counted twice, and the running total is updated by the difference.
+    
+    Stored in SQLite so an upload only reads and writes the rows of its own
+    customers, whatever the size of the index. Calls block, run them off the
+    event loop.
+    """
+    
+    def __init__(self, file_name: str = "customer_index.sqlite3"):
+        self.path = os.path.join(DATA_DIR, file_name)
+        self.initialized = False
+    
+    def connect(self) -> sqlite3.Connection:
+        """New connection, one per call so it can be used from any thread"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self.initialized:
+            # WAL lets readers go on while an upload writes, also from other API processes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS identities (
+                    id TEXT PRIMARY KEY, name TEXT, phone_number TEXT, email TEXT, address TEXT,
+                    total_purchase_amount REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, identity_id TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS blocks (block TEXT, identity_id TEXT, PRIMARY KEY (block, identity_id));
+                CREATE TABLE IF NOT EXISTS purchases (
+                    identity_id TEXT, serial_number TEXT, amount REAL NOT NULL,
+                    PRIMARY KEY (identity_id, serial_number)
+                );
+            """)
+            self.initialized = True
+        return connection
+    
+    def find(self, connection, name, phone, email, serial_numbers=()) -> Optional[str]:
+        """Identity id of a customer, or None if it is new"""
+        for key in exact_keys(name, phone, email):
+            row = connection.execute("SELECT identity_id FROM keys WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                return row['identity_id']
+        
+        normalized = normalize_name(name)
+        if PLACEHOLDER_NAME.match(normalized):
+            # An invoice has one buyer, a made up name can be matched on the invoice's serial number
+            for serial_number in serial_numbers:
+                row = connection.execute("SELECT identity_id FROM keys WHERE key = ?", (f"serial:{serial_number}",)).fetchone()
+                if row is not None:
+                    return row['identity_id']
+            return None
+        
+        if not normalized:
+            return None
+        candidates = connection.execute(
+            "SELECT identities.id, identities.name FROM blocks JOIN identities ON identities.id = blocks.identity_id "
+            "WHERE blocks.block = ?",
+            (name_block(normalized),)
+        )
+        for row in candidates:
+            if similar_names(normalized, normalize_name(row['name'])):
+                return row['id']
+        return None
+    
+    def register(self, connection, identity_id: str, name, phone, email, serial_numbers=()) -> None:
+        """Point this customer's keys at the identity, keeping keys other identities own"""
+        keys = exact_keys(name, phone, email) + [f"serial:{serial_number}" for serial_number in serial_numbers]
+        connection.executemany(
+            "INSERT OR IGNORE INTO keys (key, identity_id) VALUES (?, ?)",
+            [(key, identity_id) for key in keys]
+        )
+        
+        normalized = normalize_name(name)
+        if normalized and not PLACEHOLDER_NAME.match(normalized):
+            connection.execute(
+                "INSERT OR IGNORE INTO blocks (block, identity_id) VALUES (?, ?)",
+                (name_block(normalized), identity_id)
+            )
+    
+    def resolve(self, customers, invoices, document: str) -> None:
+        """Give each extracted customer its persistent identity, in place
+        
+        customers and invoices are the Customer and Invoice models of one
+        extraction, document identifies the uploaded file (its hash), which
+        scopes the totals of customers listed without invoices. Each
+        customer gets the identity's id, any contact details the identity
+        already knows, and the identity's running purchase total.
+        """
+        # Amount per invoice serial number for each customer name in this upload
+        purchases: Dict[str, Dict[str, float]] = {}
+        for invoice in invoices:
+            serials = purchases.setdefault(invoice.customer_name, {})
+            serials[invoice.serial_number] = serials.get(invoice.serial_number, 0) + invoice.total_amount
+        
+        connection = self.connect()
+        try:
+            # Take the write lock up front so concurrent uploads can't both create the same customer
+            connection.execute("BEGIN IMMEDIATE")
+            for customer in customers:
+                serial_numbers = list(purchases.get(customer.name, {}))
+                identity_id = self.find(connection, customer.name, customer.phone_number, customer.email, serial_numbers)
+                if identity_id is None:
+                    identity_id = str(uuid.uuid4())
+                    connection.execute("INSERT INTO identities (id, name) VALUES (?, ?)", (identity_id, customer.name))
+                identity = dict(connection.execute("SELECT * FROM identities WHERE id = ?", (identity_id,)).fetchone())
+                self.register(connection, identity_id, customer.name, customer.phone_number, customer.email, serial_numbers)
+                
+                # A real name replaces a made up one, contact details fill gaps
+                if PLACEHOLDER_NAME.match(identity['name']) and not PLACEHOLDER_NAME.match(customer.name):
+                    identity['name'] = customer.name
+                for field in ('phone_number', 'email', 'address'):
+                    if not identity[field] and getattr(customer, field):
+                        identity[field] = getattr(customer, field)
+                
+                # Without invoices the customer's own total stands in for its purchases in this document
+                new_purchases = purchases.get(customer.name) or {f"total:{document}": customer.total_purchase_amount}
+                for serial_number, amount in new_purchases.items():
+                    row = connection.execute(
+                        "SELECT amount FROM purchases WHERE identity_id = ? AND serial_number = ?",
+                        (identity_id, serial_number)
+                    ).fetchone()
+                    previous = row['amount'] if row is not None else 0
+                    connection.execute(
+                        "INSERT OR REPLACE INTO purchases (identity_id, serial_number, amount) VALUES (?, ?, ?)",
+                        (identity_id, serial_number, amount)
+                    )
+                    identity['total_purchase_amount'] = round(identity['total_purchase_amount'] + amount - previous, 2)
+                
+                connection.execute(
+                    "UPDATE identities SET name = ?, phone_number = ?, email = ?, address = ?, total_purchase_amount = ? "
+                    "WHERE id = ?",
+                    (identity['name'], identity['phone_number'], identity['email'], identity['address'],
+                     identity['total_purchase_amount'], identity_id)
+                )
+                
+                customer.id = identity_id
+                customer.total_purchase_amount = identity['total_purchase_amount']
+                for field in ('phone_number', 'email', 'address'):
+                    if not getattr(customer, field):
+                        setattr(customer, field, identity[field])
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+    
+    def identities(self) -> List[Dict[str, Any]]:
+        """All known customers with their running totals"""
+        connection = self.connect()
+        try:
+            return [dict(row) for row in connection.execute("SELECT * FROM identities")]
+        finally:
+            connection.close()
+
+# Shared by all requests
+customer_index = CustomerIndex()
@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from typing import Dict, NamedTuple, Optional
+
+# Longest a request may spend extracting, clients can ask for less
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "300"))
+
+# How often a running extraction checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+class RequestAbandoned(BaseException):
+    """The request's work should stop
+    
+    A BaseException like asyncio.CancelledError, so the broad
+    `except Exception` fallbacks in the extractors don't turn it into
+    another round of work.
+    """
+
+class DeadlineExceeded(RequestAbandoned):
+    pass
+
+class ClientDisconnected(RequestAbandoned):
+    pass
+
+# Worker calls still running per cancel marker, the marker is kept until they have finished
+_workers_running: Dict[str, int] = {}
+_workers_lock = threading.Lock()
+
+class Deadline(NamedTuple):
+    """When a request's work must stop, passed as plain data into worker processes
+    
+    cancel_marker is a file the API creates when the client goes away, so
+    work running in another process notices at its next check.
+    """
+    expires_at: float
+    cancel_marker: Optional[str] = None
+    
+    def remaining(self) -> float:
+        return self.expires_at - time.time()
+    
+    def check(self) -> None:
+        if self.cancel_marker and os.path.exists(self.cancel_marker):
+            raise ClientDisconnected("Client disconnected")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+    
+    def cancel(self) -> None:
+        """Tell work in other processes to stop"""
+        if self.cancel_marker:
+            with open(self.cancel_marker, 'w'):
+                pass
+    
+    def clean_up(self) -> None:
+        """Remove the cancel marker, or leave that to the last worker call still running"""
+        if not self.cancel_marker:
+            return
+        with _workers_lock:
+            if self.cancel_marker not in _workers_running and os.path.exists(self.cancel_marker):
+                os.remove(self.cancel_marker)
+    
+    def worker_started(self) -> None:
+        """Count a call handed to a worker, which may go on after the request was abandoned"""
+        if self.cancel_marker:
+            with _workers_lock:
+                _workers_running[self.cancel_marker] = _workers_running.get(self.cancel_marker, 0) + 1
+    
+    def worker_finished(self) -> None:
+        """The worker call is done, the last one removes a marker left by an abandoned request"""
+        if not self.cancel_marker:
+            return
+        with _workers_lock:
+            _workers_running[self.cancel_marker] -= 1
+            if _workers_running[self.cancel_marker] > 0:
+                return
+            del _workers_running[self.cancel_marker]
+            if os.path.exists(self.cancel_marker):
+                os.remove(self.cancel_marker)
+
+# Deadline of the request being handled, copied into tasks and threads it starts
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar('current_deadline', default=None)
+
+def check_deadline() -> None:
+    """Stop here if the current request ran out of time or its client left"""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+def remaining_seconds() -> Optional[float]:
+    deadline = current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+async def run_until_abandoned(coro, deadline: Deadline, request=None):
+    """Await coro, cancelling it when the deadline passes or the client disconnects"""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, max(deadline.remaining(), 0)))
+            if done:
+                return task.result()
+            if deadline.remaining() <= 0:
+                raise DeadlineExceeded("Request deadline exceeded")
+            if request is not None and await request.is_disconnected():
+                raise ClientDisconnected("Client disconnected")
+    finally:
+        if not task.done():
+            deadline.cancel()
+            task.cancel()
@@ -1,5 +1,7 @@
 from .pdf_extractor import PDFExtractor
 from .image_extractor import ImageExtractor
 from .excel_extractor import ExcelExtractor
+from .csv_extractor import CSVExtractor
+from .paired_extractor import PairedExcelExtractor
 
-__all__ = ['PDFExtractor', 'ImageExtractor', 'ExcelExtractor'] 
\ No newline at end of file
+__all__ = ['PDFExtractor', 'ImageExtractor', 'ExcelExtractor', 'CSVExtractor', 'PairedExcelExtractor']
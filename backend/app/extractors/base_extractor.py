@@ -1,10 +1,38 @@
+import os
+import copy
+import json
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, NamedTuple, Optional
+import numpy as np
 from ..models import ExtractedData
+from ..model_client import ModelClient, create_model_client
+from ..prompts import prompt_registry
+from ..model_scheduler import model_scheduler
+from ..columnar import round2, column, present, not_none, write_column
+
+# Result sets with at least this many rows are preprocessed column-wise
+COLUMNAR_MIN_ROWS = int(os.getenv("COLUMNAR_MIN_ROWS", "1000"))
+
+# Most fields asked for again in one follow-up request, more than that is no longer a small repair (0 disables repairs)
+REPAIR_MAX_FIELDS = int(os.getenv("REPAIR_MAX_FIELDS", "20"))
+
+class Issue(NamedTuple):
+    """A field that failed validation, e.g. ('invoices', 0, 'serial_number', ...)"""
+    section: str
+    index: int
+    field: str
+    message: str
 
 class BaseExtractor(ABC):
     """Base class for all data extractors"""
     
+    # Gemini model used by extractors that call one
+    MODEL_NAME = 'gemini-1.5-pro'
+    
+    def create_model_client(self) -> ModelClient:
+        """Model client to call, live, recording or replaying per MODEL_CLIENT_MODE"""
+        return create_model_client(self.MODEL_NAME)
+    
     @abstractmethod
     async def extract(self, file_path: str) -> ExtractedData:
         """Extract data from a file and return structured data"""
@@ -12,6 +40,12 @@ class BaseExtractor(ABC):
     
     def preprocess_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Preprocess the extracted data to ensure it matches our model requirements"""
+        rows = len(data.get('invoices', [])) + len(data.get('products', []))
+        if rows >= COLUMNAR_MIN_ROWS:
+            processed_data = self.preprocess_columnar(data)
+            if processed_data is not None:
+                return processed_data
+        
         processed_data = {
             'invoices': [],
             'products': data.get('products', []),
@@ -122,26 +156,188 @@ class BaseExtractor(ABC):
         
         return processed_data
     
-    def validate_data(self, data):
-        """Validate the extracted data and return any validation errors"""
-        validation_errors = []
+    def preprocess_columnar(self, data: Dict[str, Any]):
+        """preprocess_data for large result sets, as array operations over whole columns
+        
+        Gives the same values as the row by row version and updates the dicts
+        in place instead of copying each invoice. Returns None for data it
+        doesn't handle (list valued invoices, non-numeric or missing values the
+        row by row version would trip over), which then takes the normal path.
+        """
+        invoices = data.get('invoices', [])
+        products = data.get('products', [])
+        customers = data.get('customers', [])
+        
+        tax = column(products, 'tax')
+        unit_price = column(products, 'unit_price')
+        quantity = column(products, 'quantity')
+        price_with_tax = column(products, 'price_with_tax')
+        discount = column(products, 'discount')
+        invoice_tax = column(invoices, 'tax')
+        invoice_total = column(invoices, 'total_amount')
+        customer_total = column(customers, 'total_purchase_amount')
+        if any(values is None for values in (tax, unit_price, quantity, price_with_tax, discount,
+                                             invoice_tax, invoice_total, customer_total)):
+            return None
+        
+        has_unit_price = present(products, 'unit_price')
+        has_price_with_tax = present(products, 'price_with_tax')
+        has_invoice_tax = present(invoices, 'tax')
+        has_invoice_total = present(invoices, 'total_amount')
+        has_customer_total = present(customers, 'total_purchase_amount')
+        
+        # Values rounded whenever present must not be None (NaN is left to the row version too)
+        if np.isnan(quantity).any() or \
+                (has_unit_price & np.isnan(unit_price)).any() or \
+                (has_price_with_tax & np.isnan(price_with_tax)).any() or \
+                (has_invoice_tax & np.isnan(invoice_tax)).any() or \
+                (has_invoice_total & np.isnan(invoice_total)).any() or \
+                (has_customer_total & np.isnan(customer_total)).any():
+            return None
+        
+        # Invoices point at the first product with their product name
+        first_product = {}
+        if invoices:
+            for i, product in enumerate(products):
+                if 'name' not in product or not isinstance(product['name'], (str, type(None))):
+                    return None
+                first_product.setdefault(product['name'], i)
+        
+        if not set(type(invoice.get('product_name')) for invoice in invoices) <= {str, type(None)}:
+            return None
+        
+        product_index = np.fromiter(
+            (first_product.get(invoice.get('product_name'), -1) for invoice in invoices),
+            dtype=np.intp, count=len(invoices)
+        )
+        matched = product_index >= 0
+        if not has_price_with_tax[product_index[matched]].all():
+            return None
+        
+        # Products: tax percentages become amounts, missing taxes are derived, values rounded
+        has_tax = not_none(products, 'tax')
+        with np.errstate(invalid='ignore'):
+            is_percentage = has_tax & (tax <= 100) & has_unit_price
+            is_derived = ~has_tax & has_price_with_tax & has_unit_price
+            is_amount = has_tax & ~is_percentage
+            
+            derived = round2(price_with_tax - unit_price * quantity)
+            # Price with tax below the net price means a discount, not a negative tax
+            derived[derived < 0] = 0
+        
+        new_tax = np.zeros(len(products))
+        new_tax[is_percentage] = round2(unit_price * quantity * tax / 100)[is_percentage]
+        new_tax[is_derived] = derived[is_derived]
+        new_tax[is_amount] = round2(tax)[is_amount]
+        
+        rounded_price_with_tax = round2(price_with_tax)
+        write_column(products, 'tax', new_tax)
+        write_column(products, 'price_with_tax', rounded_price_with_tax, has_price_with_tax)
+        write_column(products, 'unit_price', round2(unit_price), has_unit_price)
+        write_column(products, 'discount', round2(discount), not_none(products, 'discount'))
+        
+        # Invoices take tax and total from their product, the rest are only rounded
+        matched_products = product_index[matched]
+        for i, tax_value, total in zip(np.flatnonzero(matched).tolist(),
+                                       new_tax[matched_products].tolist(),
+                                       rounded_price_with_tax[matched_products].tolist()):
+            invoices[i]['tax'] = tax_value
+            invoices[i]['total_amount'] = total
+        
+        write_column(invoices, 'tax', round2(invoice_tax), ~matched & has_invoice_tax)
+        write_column(invoices, 'total_amount', round2(invoice_total), ~matched & has_invoice_total)
+        
+        write_column(customers, 'total_purchase_amount', round2(customer_total), has_customer_total)
+        
+        return {
+            'invoices': invoices,
+            'products': products,
+            'customers': customers
+        }
+    
+    def find_issues(self, data) -> List[Issue]:
+        """Fields of the extracted data that are missing or look wrong"""
+        issues = []
         
         # Check invoices
         for i, invoice in enumerate(data.get('invoices', [])):
             if not invoice.get('serial_number'):
-                validation_errors.append(f"Invoice {i+1} is missing serial number")
+                issues.append(Issue('invoices', i, 'serial_number', f"Invoice {i+1} is missing serial number"))
             
             # Only validate total_amount if it's explicitly zero, not if it's missing
             if 'total_amount' in invoice and invoice['total_amount'] == 0:
-                validation_errors.append(f"Invoice {i+1} has zero total amount")
+                issues.append(Issue('invoices', i, 'total_amount', f"Invoice {i+1} has zero total amount"))
         
         # Check products
         for i, product in enumerate(data.get('products', [])):
             if not product.get('name'):
-                validation_errors.append(f"Product {i+1} is missing name")
+                issues.append(Issue('products', i, 'name', f"Product {i+1} is missing name"))
             
             # Only validate unit_price if it's explicitly zero, not if it's missing
             if 'unit_price' in product and product['unit_price'] == 0:
-                validation_errors.append(f"Product {i+1} has zero unit price")
+                issues.append(Issue('products', i, 'unit_price', f"Product {i+1} has zero unit price"))
+        
+        return issues
+    
+    def validate_data(self, data):
+        """Validate the extracted data and return any validation errors"""
+        return [issue.message for issue in self.find_issues(data)]
+    
+    def parse_response(self, response) -> Dict[str, Any]:
+        """The model's answer as JSON"""
+        response_text = response.text
         
-        return validation_errors 
\ No newline at end of file
+        # Clean up the response to get valid JSON
+        # Remove markdown code block indicators if present
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+        
+        return json.loads(response_text)
+    
+    async def repair(self, raw_data: Dict[str, Any], document_type: str, payload) -> Optional[Dict[str, Any]]:
+        """Ask the model again for just the fields that failed validation
+        
+        raw_data is the model's output before preprocessing. The rows with
+        issues are sent back as context with the document, and the answer is
+        patched into a copy of raw_data, which is returned for preprocessing
+        again. Returns None if there was nothing to repair or nothing changed.
+        """
+        issues = self.find_issues(raw_data)
+        if not issues or len(issues) > REPAIR_MAX_FIELDS:
+            return None
+        
+        rows = {f"{issue.section}[{issue.index}]": raw_data[issue.section][issue.index] for issue in issues}
+        fields = [(f"{issue.section}[{issue.index}].{issue.field}", issue.message) for issue in issues]
+        prompt = prompt_registry.get_repair(document_type, rows, fields)
+        
+        try:
+            response = await model_scheduler.run(prompt_registry.generate, self.model, prompt, payload)
+            answer = self.parse_response(response)
+        except Exception as e:
+            print(f"Repair request failed: {str(e)}")
+            return None
+        
+        repaired = copy.deepcopy(raw_data)
+        patched = 0
+        for issue in issues:
+            value = repaired_value(issue.field, answer.get(f"{issue.section}[{issue.index}].{issue.field}"))
+            if value is not None:
+                repaired[issue.section][issue.index][issue.field] = value
+                patched += 1
+        
+        print(f"Repaired {patched} of {len(issues)} fields with a follow-up request")
+        return repaired if patched else None
+
+def repaired_value(field: str, value):
+    """A value from a repair answer, or None if it doesn't fix the field"""
+    if field in ('total_amount', 'unit_price'):
+        try:
+            value = float(str(value).replace(',', ''))
+        except (TypeError, ValueError):
+            return None
+        return value if value > 0 else None
+    
+    value = str(value).strip() if value is not None else ''
+    return value or None
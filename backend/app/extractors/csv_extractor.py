@@ -0,0 +1,127 @@
+import os
+import csv
+import codecs
+import pandas as pd
+from ..deadlines import check_deadline
+from .excel_extractor import ExcelExtractor, SNIFF_ROWS
+
+# Rows per chunk when streaming a CSV, keeps memory bounded for multi-GB exports
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "50000"))
+
+# Bytes read from the start of the file to detect encoding and delimiter
+SNIFF_BYTES = 64 * 1024
+
+class CSVExtractor(ExcelExtractor):
+    """Extract data from CSV/TSV exports, streaming them in fixed-size chunks
+    
+    Reuses the invoice summary and product detail logic of ExcelExtractor,
+    aggregating invoice and customer totals chunk by chunk.
+    """
+    
+    def detect_encoding(self, sample):
+        """Guess the text encoding from the first bytes of the file"""
+        for encoding in ['utf-8-sig', 'cp1252']:
+            try:
+                # Incremental decode so a character cut off at the end of the sample is not an error
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        
+        # latin-1 can decode any byte sequence
+        return 'latin-1'
+    
+    def detect_delimiter(self, file_path, text):
+        """Guess the delimiter from the file extension and a sample of the text"""
+        if os.path.splitext(file_path)[1].lower() == '.tsv':
+            return '\t'
+        
+        try:
+            return csv.Sniffer().sniff(text, delimiters=',;\t|').delimiter
+        except csv.Error:
+            return ','
+    
+    def sniff_file(self, file_path):
+        """Detect the encoding and delimiter of the file"""
+        with open(file_path, 'rb') as f:
+            sample = f.read(SNIFF_BYTES)
+        
+        encoding = self.detect_encoding(sample)
+        text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+        
+        # Only sniff complete lines
+        if '\n' in text:
+            text = text[:text.rindex('\n')]
+        
+        return encoding, self.detect_delimiter(file_path, text)
+    
+    def read_csv(self, file_path, encoding, delimiter, **kwargs):
+        return pd.read_csv(file_path, encoding=encoding, sep=delimiter, **kwargs)
+    
+    def parse(self, file_path: str):
+        """Parse the CSV file and return the result as plain data (runs in a worker process)"""
+        try:
+            encoding, delimiter = self.sniff_file(file_path)
+            print(f"CSV encoding: {encoding}, delimiter: {delimiter!r}")
+            
+            # Resolve the column plan from the header and a few rows
+            sample = self.read_csv(file_path, encoding, delimiter, nrows=SNIFF_ROWS)
+            print(f"CSV columns: {sample.columns.tolist()}")
+            file_format, column_mapping = self.detect_format(sample)
+            
+            if file_format == 'generic':
+                # The generic heuristic needs the whole file at once
+                print("Unknown CSV format, using generic approach")
+                extracted_data = self.process_generic_format(self.read_csv(file_path, encoding, delimiter))
+            else:
+                if file_format == 'invoice_summary':
+                    print("Processing invoice summary format")
+                    state = self.new_invoice_summary_state()
+                    accumulate, build = self.accumulate_invoice_summary, self.build_invoice_summary
+                else:
+                    print("Processing product detail format")
+                    state = self.new_product_detail_state()
+                    accumulate, build = self.accumulate_product_detail, self.build_product_detail
+                
+                # Stream only the mapped columns, one chunk at a time
+                chunks = self.read_csv(
+                    file_path,
+                    encoding,
+                    delimiter,
+                    usecols=list(dict.fromkeys(column_mapping.values())),
+                    dtype=self.text_dtypes(column_mapping),
+                    chunksize=CSV_CHUNK_ROWS
+                )
+                with chunks:
+                    for chunk in chunks:
+                        check_deadline()
+                        accumulate(self.coerce_numeric_columns(chunk, column_mapping), column_mapping, state)
+                
+                extracted_data = build(state)
+            
+            # Check if we got any data
+            if (not extracted_data.get('invoices') and
+                not extracted_data.get('products') and
+                not extracted_data.get('customers')):
+                raise ValueError("No data extracted from CSV file")
+            
+            # Preprocess the data
+            extracted_data = self.preprocess_data(extracted_data)
+            
+            # Validate the data
+            validation_errors = self.validate_data(extracted_data)
+            
+            return self.build_result(
+                invoices=extracted_data.get('invoices', []),
+                products=extracted_data.get('products', []),
+                customers=extracted_data.get('customers', []),
+                validation_errors=validation_errors
+            )
+        except Exception as e:
+            print(f"CSV file reading error: {str(e)}")
+            return self.build_result(
+                invoices=[],
+                products=[],
+                customers=[],
+                validation_errors=[f"Error reading CSV file: {str(e)}"]
+            )
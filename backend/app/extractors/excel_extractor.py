@@ -1,20 +1,78 @@
+import asyncio
 import pandas as pd
 import os
 import json
 import re
-import google.generativeai as genai
 from dotenv import load_dotenv
 from ..models import ExtractedData
+from ..fingerprints import FingerprintStore, row_fingerprint
+from ..schema_registry import header_fingerprint, schema_registry
+from ..workers import run_in_process
+from ..deadlines import current_deadline, check_deadline
 from .base_extractor import BaseExtractor
 
 load_dotenv()
 
+# Expected column names for the two spreadsheet layouts we know how to parse
+INVOICE_SUMMARY_COLUMNS = ['Serial Number', 'Party Name', 'Party Company Name', 'Net Amount', 'Tax Amount', 'Total Amount', 'Date']
+PRODUCT_DETAIL_COLUMNS = ['Serial Number', 'Invoice Date', 'Product Name', 'Qty', 'Price with Tax', 'Unit Price', 'Tax (%)']
+
+# Explicit dtypes for the mapped columns, so pandas doesn't have to infer them
+TEXT_COLUMNS = ['Serial Number', 'Party Name', 'Party Company Name', 'Product Name']
+NUMERIC_COLUMNS = ['Net Amount', 'Tax Amount', 'Total Amount', 'Qty', 'Price with Tax', 'Unit Price', 'Tax (%)']
+
+# Rows read in the first pass to sniff the header (and give the model a few samples)
+SNIFF_ROWS = 5
+
+def default_excel_engine():
+    """Use the Rust based calamine engine when this pandas version supports it"""
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    
+    major, minor = (int(part) for part in pd.__version__.split('.')[:2])
+    if (major, minor) >= (2, 2):
+        return 'calamine'
+    return None
+
+# Engine passed to pd.read_excel, None lets pandas pick (openpyxl for xlsx)
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE") or default_excel_engine()
+
+def parse_in_worker(extractor_class, file_path, delta, deadline=None):
+    """Entry point run inside the process pool, builds its own extractor there
+    
+    The request's deadline is installed here so parsing stops at its next
+    check once the request ran out of time or was abandoned.
+    """
+    token = current_deadline.set(deadline)
+    try:
+        extractor = extractor_class(delta=delta)
+        result = extractor.parse(file_path)
+        # Plans are saved by the API process, like the delta fingerprints
+        result['plans'] = extractor.learned_plans
+        return result
+    finally:
+        current_deadline.reset(token)
+
+def normalize_serial(value):
+    """Turn a serial number cell into a clean string (empty if missing)"""
+    if pd.isna(value):
+        return ''
+    return str(value).strip()
+
 class ExcelExtractor(BaseExtractor):
     """Extract data from Excel files using pandas and Google Gemini for complex cases"""
     
-    def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-1.5-pro')
+    def __init__(self, delta: bool = False):
+        self.model = self.create_model_client()
+        
+        # In delta mode only rows that were not ingested before are processed
+        self.delta = delta
+        self.fingerprint_store = FingerprintStore() if delta else None
+        
+        # Column plans learned while parsing, see detect_format
+        self.learned_plans = {}
     
     def clean_json_response(self, response_text):
         """Clean up the JSON response to make it valid"""
@@ -73,30 +131,138 @@ class ExcelExtractor(BaseExtractor):
         
         return products
     
-    def extract_from_dataframe(self, df):
-        """Extract structured data directly from the pandas DataFrame"""
-        invoices = []
-        products = {}
-        
-        # Check if the DataFrame has the expected columns for invoice summary format
-        invoice_summary_columns = ['Serial Number', 'Party Name', 'Net Amount', 'Tax Amount', 'Total Amount', 'Date']
-        product_detail_columns = ['Serial Number', 'Invoice Date', 'Product Name', 'Qty', 'Price with Tax', 'Unit Price', 'Tax (%)']
-        
+    def resolve_column_mapping(self, df):
+        """Map the expected column names to the actual DataFrame columns"""
         column_mapping = {}
         
         # Try to find matching columns (case-insensitive)
-        for expected in invoice_summary_columns + product_detail_columns:
+        for expected in INVOICE_SUMMARY_COLUMNS + PRODUCT_DETAIL_COLUMNS:
             for col in df.columns:
-                if expected.lower() in col.lower():
+                if expected.lower() in str(col).lower():
                     column_mapping[expected] = col
                     break
         
-        # Determine which format we're dealing with
+        return column_mapping
+    
+    def classify_mapping(self, column_mapping):
+        """Decide which format a column mapping describes"""
         if all(col in column_mapping for col in ['Serial Number', 'Party Name', 'Net Amount', 'Tax Amount', 'Total Amount']):
+            return 'invoice_summary'
+        elif all(col in column_mapping for col in ['Serial Number', 'Product Name']):
+            return 'product_detail'
+        return 'generic'
+    
+    def infer_mapping_with_model(self, df):
+        """Ask the model once to map an unknown header row to our expected columns"""
+        headers = [str(col) for col in df.columns]
+        sample_rows = df.head(5).to_csv(index=False)
+        expected_columns = list(dict.fromkeys(INVOICE_SUMMARY_COLUMNS + PRODUCT_DETAIL_COLUMNS))
+        
+        prompt = f"""
+        A spreadsheet of invoices has these column headers:
+        {json.dumps(headers)}
+        
+        Here are its first rows as CSV:
+        {sample_rows}
+        
+        Map each of these expected fields to the header that holds it, or null if none does:
+        {json.dumps(expected_columns)}
+        
+        IMPORTANT: Return ONLY a JSON object whose keys are the expected fields and whose values are headers from the list above or null.
+        """
+        
+        response = self.model.generate_content(prompt)
+        suggested = json.loads(self.clean_json_response(response.text))
+        
+        # Only keep suggestions that point at real columns
+        columns_by_name = {str(col): col for col in df.columns}
+        return {
+            expected: columns_by_name[header]
+            for expected, header in suggested.items()
+            if expected in expected_columns and header in columns_by_name
+        }
+    
+    def select_delta_rows(self, df, column_mapping):
+        """Keep only the rows that are new or changed since earlier uploads
+        
+        Returns the filtered DataFrame and the fingerprints of all rows keyed by
+        layout, recording them refreshes rows that are still exported. All rows of an invoice are kept when any of them changed, so per-invoice
+        totals are never built from a partial set of line items.
+        """
+        serial_col = column_mapping.get('Serial Number')
+        serial_index = df.columns.get_loc(serial_col) if serial_col is not None else None
+        # Scope fingerprints to the layout so identical cells in another layout don't collide
+        layout = header_fingerprint(df.columns)
+        
+        serials = []
+        fingerprints = []
+        for row in df.itertuples(index=False, name=None):
+            serial_number = ''
+            if serial_index is not None:
+                serial_number = normalize_serial(row[serial_index])
+            serials.append(serial_number)
+            fingerprints.append(row_fingerprint(serial_number, (layout,) + row))
+        
+        is_new = self.fingerprint_store.unseen(layout, fingerprints)
+        changed_serials = {serial for serial, new in zip(serials, is_new) if new and serial}
+        keep = [new or (serial in changed_serials) for serial, new in zip(serials, is_new)]
+        return df[keep], {layout: fingerprints}
+    
+    def read_excel(self, file_path, **kwargs):
+        """Read a spreadsheet with the configured engine, falling back to the pandas default"""
+        if EXCEL_ENGINE:
+            try:
+                return pd.read_excel(file_path, engine=EXCEL_ENGINE, **kwargs)
+            except Exception as e:
+                print(f"Excel engine {EXCEL_ENGINE} failed, using default: {str(e)}")
+        return pd.read_excel(file_path, **kwargs)
+    
+    def load_dataframe(self, file_path):
+        """Load the spreadsheet in two passes
+        
+        The first pass only reads the header and a few rows to resolve the
+        column plan. The second pass loads just the mapped columns with
+        explicit dtypes. Unknown layouts are loaded whole for the generic parser.
+        
+        Returns the DataFrame, the detected format and the column mapping.
+        """
+        sample = self.read_excel(file_path, nrows=SNIFF_ROWS)
+        file_format, column_mapping = self.detect_format(sample)
+        
+        if file_format == 'generic':
+            return self.read_excel(file_path), file_format, column_mapping
+        
+        usecols = list(dict.fromkeys(column_mapping.values()))
+        df = self.read_excel(file_path, usecols=usecols, dtype=self.text_dtypes(column_mapping))
+        
+        return self.coerce_numeric_columns(df, column_mapping), file_format, column_mapping
+    
+    def text_dtypes(self, column_mapping):
+        """Explicit str dtypes for the mapped text columns"""
+        return {column_mapping[name]: str for name in TEXT_COLUMNS if name in column_mapping}
+    
+    def coerce_numeric_columns(self, df, column_mapping):
+        """Convert the mapped numeric columns to numbers
+        
+        Non numeric cells (e.g. a "Total" label) become NaN and are treated as missing.
+        """
+        for name in NUMERIC_COLUMNS:
+            if name in column_mapping:
+                col = column_mapping[name]
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+    
+    def extract_from_dataframe(self, df, file_format=None, column_mapping=None):
+        """Extract structured data directly from the pandas DataFrame"""
+        # Determine which format we're dealing with
+        if file_format is None:
+            file_format, column_mapping = self.detect_format(df)
+        
+        if file_format == 'invoice_summary':
             # This is an invoice summary format
             print("Processing invoice summary format")
             return self.process_invoice_summary(df, column_mapping)
-        elif all(col in column_mapping for col in ['Serial Number', 'Product Name']):
+        elif file_format == 'product_detail':
             # This is a product detail format
             print("Processing product detail format")
             return self.process_product_detail(df, column_mapping)
@@ -105,12 +271,38 @@ class ExcelExtractor(BaseExtractor):
             print("Unknown Excel format, using generic approach")
             return self.process_generic_format(df)
 
+    def build_customer_objects(self, customer_totals):
+        """Create customer objects from the per-customer purchase totals"""
+        customer_objects = []
+        for customer_name, total_amount in customer_totals.items():
+            customer_objects.append({
+                "name": customer_name,
+                "phone_number": None,
+                "total_purchase_amount": total_amount,
+                "address": None,
+                "email": None
+            })
+        return customer_objects
+    
     def process_invoice_summary(self, df, column_mapping):
         """Process Excel file in invoice summary format"""
-        invoices = []
-        products = []
-        customer_objects = []
-        customer_totals = {}
+        state = self.new_invoice_summary_state()
+        self.accumulate_invoice_summary(df, column_mapping, state)
+        return self.build_invoice_summary(state)
+    
+    def new_invoice_summary_state(self):
+        """Running results for the invoice summary format, filled one chunk at a time"""
+        return {
+            "invoices": [],
+            "products": [],
+            "customer_totals": {}
+        }
+    
+    def accumulate_invoice_summary(self, df, column_mapping, state):
+        """Add the rows of a DataFrame (or one chunk of a file) to the invoice summary results"""
+        invoices = state["invoices"]
+        products = state["products"]
+        customer_totals = state["customer_totals"]
         
         # Process each row
         for _, row in df.iterrows():
@@ -193,29 +385,34 @@ class ExcelExtractor(BaseExtractor):
                 customer_totals[customer_name] += total_amount
             else:
                 customer_totals[customer_name] = total_amount
-        
-        # Create customer objects
-        for customer_name, total_amount in customer_totals.items():
-            customer_objects.append({
-                "name": customer_name,
-                "phone_number": None,
-                "total_purchase_amount": total_amount,
-                "address": None,
-                "email": None
-            })
-        
+    
+    def build_invoice_summary(self, state):
+        """Turn the accumulated invoice summary results into the extracted data dict"""
         return {
-            "invoices": invoices,
-            "products": products,
-            "customers": customer_objects
+            "invoices": state["invoices"],
+            "products": state["products"],
+            "customers": self.build_customer_objects(state["customer_totals"])
         }
     
     def process_product_detail(self, df, column_mapping):
         """Process Excel file in product detail format with line items"""
-        invoices = []
-        products = {}
-        invoice_totals = {}
-        customer_totals = {}
+        state = self.new_product_detail_state()
+        self.accumulate_product_detail(df, column_mapping, state)
+        return self.build_product_detail(state)
+    
+    def new_product_detail_state(self):
+        """Running results for the product detail format, filled one chunk at a time"""
+        return {
+            "products": {},
+            "invoice_totals": {},
+            "customer_totals": {}
+        }
+    
+    def accumulate_product_detail(self, df, column_mapping, state):
+        """Add the line items of a DataFrame (or one chunk of a file) to the product detail results"""
+        products = state["products"]
+        invoice_totals = state["invoice_totals"]
+        customer_totals = state["customer_totals"]
         
         # Process each row
         for _, row in df.iterrows():
@@ -327,9 +524,13 @@ class ExcelExtractor(BaseExtractor):
             if customer_name not in customer_totals:
                 customer_totals[customer_name] = 0
             customer_totals[customer_name] += price_with_tax
+    
+    def build_product_detail(self, state):
+        """Turn the accumulated product detail results into the extracted data dict"""
+        invoices = []
         
         # Create invoice objects
-        for serial_number, invoice_data in invoice_totals.items():
+        for serial_number, invoice_data in state["invoice_totals"].items():
             for product in invoice_data["products"]:
                 invoices.append({
                     'serial_number': serial_number,
@@ -341,21 +542,10 @@ class ExcelExtractor(BaseExtractor):
                     'date': invoice_data['date']
                 })
         
-        # Create customer objects
-        customer_objects = []
-        for customer_name, total_amount in customer_totals.items():
-            customer_objects.append({
-                "name": customer_name,
-                "phone_number": None,
-                "total_purchase_amount": total_amount,
-                "address": None,
-                "email": None
-            })
-        
         return {
             "invoices": invoices,
-            "products": list(products.values()),
-            "customers": customer_objects
+            "products": list(state["products"].values()),
+            "customers": self.build_customer_objects(state["customer_totals"])
         }
     
     def process_generic_format(self, df):
@@ -479,16 +669,65 @@ class ExcelExtractor(BaseExtractor):
         }
     
     async def extract(self, file_path: str) -> ExtractedData:
+        # Parsing is CPU bound, run it in the process pool so the event loop stays free
+        try:
+            result = await run_in_process(parse_in_worker, type(self), file_path, self.delta, current_deadline.get())
+        except Exception as e:
+            print(f"Spreadsheet worker error: {str(e)}")
+            result = self.build_result(validation_errors=[f"Error reading file: {str(e)}"])
+        
+        # Only remember the delta rows once they were extracted successfully
+        if result.get('fingerprints'):
+            await asyncio.to_thread(self.fingerprint_store.add, result['fingerprints'])
+        if result.get('plans'):
+            await asyncio.to_thread(schema_registry.put_many, result['plans'])
+        
+        return ExtractedData(
+            invoices=result['invoices'],
+            products=result['products'],
+            customers=result['customers'],
+            validation_errors=result['validation_errors']
+        )
+    
+    def build_result(self, invoices=None, products=None, customers=None, validation_errors=None, fingerprints=None):
+        """Plain dict result of parse, cheap to hand back from a worker process"""
+        return {
+            'invoices': invoices or [],
+            'products': products or [],
+            'customers': customers or [],
+            'validation_errors': validation_errors or [],
+            'fingerprints': fingerprints or {}
+        }
+    
+    def parse(self, file_path: str):
+        """Parse the spreadsheet and return the result as plain data (runs in a worker process)"""
         try:
             # First try to read with pandas
-            df = pd.read_excel(file_path)
+            df, file_format, column_mapping = self.load_dataframe(file_path)
             
             # Print column names for debugging
             print(f"Excel columns: {df.columns.tolist()}")
+            check_deadline()
+            
+            # In delta mode drop the rows we have already ingested
+            delta_fingerprints = None
+            if self.delta:
+                total_rows = len(df)
+                df, delta_fingerprints = self.select_delta_rows(df, column_mapping)
+                print(f"Delta mode: {len(df)} of {total_rows} rows are new or changed")
+                
+                if df.empty:
+                    return self.build_result(
+                        invoices=[],
+                        products=[],
+                        customers=[],
+                        validation_errors=["No new or changed rows since the previous upload"],
+                        fingerprints=delta_fingerprints
+                    )
             
             # Try direct extraction from DataFrame first
             try:
-                extracted_data = self.extract_from_dataframe(df)
+                extracted_data = self.extract_from_dataframe(df, file_format, column_mapping)
                 
                 # Check if we got any data
                 if (not extracted_data.get('invoices') and 
@@ -497,16 +736,18 @@ class ExcelExtractor(BaseExtractor):
                     raise ValueError("No data extracted from DataFrame")
                 
                 # Preprocess the data
+                check_deadline()
                 extracted_data = self.preprocess_data(extracted_data)
                 
                 # Validate the data
                 validation_errors = self.validate_data(extracted_data)
                 
-                return ExtractedData(
+                return self.build_result(
                     invoices=extracted_data.get('invoices', []),
                     products=extracted_data.get('products', []),
                     customers=extracted_data.get('customers', []),
-                    validation_errors=validation_errors
+                    validation_errors=validation_errors,
+                    fingerprints=delta_fingerprints
                 )
             except Exception as df_err:
                 print(f"Direct DataFrame extraction failed: {str(df_err)}")
@@ -572,7 +813,7 @@ class ExcelExtractor(BaseExtractor):
                         })
                     
                     # Return the extracted data
-                    return ExtractedData(
+                    return self.build_result(
                         invoices=invoices,
                         products=products,
                         customers=customer_objects,
@@ -580,9 +821,10 @@ class ExcelExtractor(BaseExtractor):
                     )
                 except Exception as simple_err:
                     print(f"Simple extraction failed: {str(simple_err)}")
+                    raise
         except Exception as e:
             print(f"Excel file reading error: {str(e)}")
-            return ExtractedData(
+            return self.build_result(
                 invoices=[],
                 products=[],
                 customers=[],
@@ -590,43 +832,35 @@ class ExcelExtractor(BaseExtractor):
             )
 
     def detect_format(self, df):
-        """Detect the format of the Excel file"""
-        columns = df.columns.tolist()
-        print(f"Excel columns: {columns}")
+        """Detect the format of the Excel file and the column mapping to use
         
-        # Check for product detail format (has Product Name, Qty, etc.)
-        if 'Product Name' in columns and 'Qty' in columns:
-            print("Processing product detail format")
-            return 'product_detail', {
-                'Serial Number': 'Serial Number',
-                'Invoice Date': 'Invoice Date',
-                'Product Name': 'Product Name',
-                'Qty': 'Qty',
-                'Price with Tax': 'Price with Tax',
-                'Unit Price': 'Unit Price',
-                'Tax (%)': 'Tax (%)'
-            }
-        
-        # Check for invoice summary format (has Party Name, Net Amount, etc.)
-        elif 'Serial Number' in columns and ('Party Name' in columns or 'Party Company Name' in columns):
-            print("Processing invoice summary format")
-            mapping = {
-                'Serial Number': 'Serial Number',
-                'Date': 'Date',
-                'Net Amount': 'Net Amount',
-                'Tax Amount': 'Tax Amount',
-                'Total Amount': 'Total Amount'
-            }
-            
-            if 'Party Name' in columns:
-                mapping['Party Name'] = 'Party Name'
-            
-            if 'Party Company Name' in columns:
-                mapping['Party Company Name'] = 'Party Company Name'
-                
-            return 'invoice_summary', mapping
+        Plans are cached in the schema registry by header fingerprint, so the
+        substring matching and any model call only happen for new layouts.
+        New plans are collected in learned_plans and saved by the API process,
+        since this runs in the worker processes.
+        """
+        fingerprint = header_fingerprint(df.columns)
         
-        # Default to generic format
-        else:
-            print("Processing generic format")
-            return 'generic', {} 
\ No newline at end of file
+        # Reuse the compiled plan if we have seen this header row before
+        plan = schema_registry.get(fingerprint)
+        if plan and all(col in df.columns for col in plan['mapping'].values()):
+            return plan['format'], plan['mapping']
+        
+        column_mapping = self.resolve_column_mapping(df)
+        file_format = self.classify_mapping(column_mapping)
+        
+        # Unknown layout, ask the model for a mapping with only the headers and a few rows
+        if file_format == 'generic':
+            try:
+                model_mapping = self.infer_mapping_with_model(df)
+                print(f"Model suggested column mapping: {model_mapping}")
+                if self.classify_mapping(model_mapping) != 'generic':
+                    column_mapping = model_mapping
+                    file_format = self.classify_mapping(model_mapping)
+            except Exception as e:
+                print(f"Model column mapping failed: {str(e)}")
+                # Don't cache a plan we couldn't confirm, the model may work next time
+                return file_format, column_mapping
+        
+        self.learned_plans[fingerprint] = {'format': file_format, 'mapping': column_mapping}
+        return file_format, column_mapping
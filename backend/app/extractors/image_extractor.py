@@ -1,8 +1,10 @@
-import os
-import json
-import google.generativeai as genai
+import copy
+import asyncio
 from dotenv import load_dotenv
 from ..models import ExtractedData
+from ..prompts import prompt_registry
+from ..model_scheduler import model_scheduler
+from ..image_tiles import tile_image, merge_tile_results
 from .base_extractor import BaseExtractor
 
 load_dotenv()
@@ -11,54 +13,59 @@ class ImageExtractor(BaseExtractor):
     """Extract data from image files using Google Gemini"""
     
     def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-1.5-pro')
+        self.model = self.create_model_client()
+    
+    async def generate(self, document_type: str, data: bytes):
+        prompt = prompt_registry.get(document_type)
+        # On a thread, so the event loop can notice a deadline or a disconnect meanwhile,
+        # once the scheduler gives this request's priority lane a slot
+        return await model_scheduler.run(
+            prompt_registry.generate, self.model, prompt, {"mime_type": "image/jpeg", "data": data}
+        )
+    
+    async def extract_tiles(self, tiles):
+        """Extract each tile concurrently and merge the line items, top to bottom"""
+        responses = await asyncio.gather(*(self.generate('image_tile', tile) for tile in tiles))
+        print(f"Extracted a tall image in {len(tiles)} tiles")
+        return merge_tile_results([self.parse_response(response) for response in responses])
     
     async def extract(self, file_path: str) -> ExtractedData:
         # Read the image file
         with open(file_path, 'rb') as f:
             data = f.read()
         
-        # Process with Gemini
-        prompt = """
-        Extract the following information from this invoice image in JSON format:
-        1. Invoice details: serial number, date, total amount, tax
-        2. Customer details: name, phone number, address (if available)
-        3. Product details: name, quantity, unit price, tax, price with tax
-        
-        Format the response as a valid JSON with three arrays: 'invoices', 'products', and 'customers'.
-        Each invoice should have: serial_number, customer_name, product_name, quantity, tax, total_amount, date
-        Each product should have: name, quantity, unit_price, tax, price_with_tax, discount (optional)
-        Each customer should have: name, phone_number, total_purchase_amount, address (optional), email (optional)
-        
-        IMPORTANT: Return ONLY the JSON object, no other text.
-        """
-        
         try:
-            response = self.model.generate_content([
-                prompt,
-                {"mime_type": "image/jpeg", "data": data}
-            ])
+            # Long receipts are read in overlapping tiles, at full resolution and concurrently.
+            # Anything going wrong there, merging and preprocessing included, reads the whole image instead
+            extracted_json = None
+            try:
+                tiles = await asyncio.to_thread(tile_image, data)
+                if tiles:
+                    raw_json = await self.extract_tiles(tiles)
+                    extracted_json = self.preprocess_data(copy.deepcopy(raw_json))
+            except Exception as e:
+                print(f"Tiled extraction failed, reading the whole image: {str(e)}")
             
-            # Extract JSON from the response
-            response_text = response.text
-            
-            # Clean up the response to get valid JSON
-            # Remove markdown code block indicators if present
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            # Parse the JSON
-            extracted_json = json.loads(response_text)
-            
-            # Preprocess the data
-            extracted_json = self.preprocess_data(extracted_json)
+            if extracted_json is None:
+                # Process with Gemini using the active prompt version for this document type
+                response = await self.generate('image', data)
+                
+                # Keep the raw output to patch, preprocessing changes it in place
+                raw_json = self.parse_response(response)
+                
+                # Preprocess the data
+                extracted_json = self.preprocess_data(copy.deepcopy(raw_json))
             
             # Validate the data
             validation_errors = self.validate_data(extracted_json)
             
+            # Ask again for just the fields that failed validation, not the whole image
+            if validation_errors:
+                repaired_json = await self.repair(raw_json, 'image', {"mime_type": "image/jpeg", "data": data})
+                if repaired_json is not None:
+                    extracted_json = self.preprocess_data(repaired_json)
+                    validation_errors = self.validate_data(extracted_json)
+            
             # Create the ExtractedData object
             return ExtractedData(
                 invoices=extracted_json.get('invoices', []),
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import pandas as pd
+from ..models import ExtractedData
+from ..workers import run_in_process
+from ..deadlines import current_deadline, check_deadline
+from ..schema_registry import schema_registry
+from .excel_extractor import ExcelExtractor, SNIFF_ROWS
+
+# Rows per chunk when streaming a workbook, keeps memory bounded for large reports
+PAIRED_CHUNK_ROWS = int(os.getenv("PAIRED_CHUNK_ROWS", "5000"))
+
+# Workbook formats openpyxl can stream row by row, others are read whole
+STREAMABLE_EXTENSIONS = ('.xlsx', '.xlsm')
+
+def parse_pair_in_worker(first_path, second_path, deadline=None):
+    """Entry point run inside the process pool, see parse_in_worker"""
+    token = current_deadline.set(deadline)
+    try:
+        extractor = PairedExcelExtractor(second_path)
+        result = extractor.parse(first_path)
+        result['plans'] = extractor.learned_plans
+        return result
+    finally:
+        current_deadline.reset(token)
+
+class PairedExcelExtractor(ExcelExtractor):
+    """Join an invoice summary workbook with its item report on serial number
+    
+    The item report has the line items but no party information, the
+    summary has party names and invoice totals but no items. The smaller
+    workbook is read into a table keyed by serial number (the build side),
+    then the larger one is streamed in chunks and each chunk is joined
+    against the table as it arrives (the probe side). Only the table, one
+    chunk and the joined rows are held in memory.
+    """
+    
+    def __init__(self, other_path: str):
+        super().__init__()
+        self.other_path = other_path
+    
+    async def extract(self, file_path: str) -> ExtractedData:
+        # Parsing is CPU bound, run it in the process pool so the event loop stays free
+        try:
+            result = await run_in_process(parse_pair_in_worker, file_path, self.other_path, current_deadline.get())
+        except Exception as e:
+            print(f"Spreadsheet worker error: {str(e)}")
+            result = self.build_result(validation_errors=[f"Error reading files: {str(e)}"])
+        
+        if result.get('plans'):
+            await asyncio.to_thread(schema_registry.put_many, result['plans'])
+        
+        return ExtractedData(
+            invoices=result['invoices'],
+            products=result['products'],
+            customers=result['customers'],
+            validation_errors=result['validation_errors']
+        )
+    
+    def iter_chunks(self, file_path, column_mapping):
+        """DataFrames of at most PAIRED_CHUNK_ROWS rows with just the mapped columns
+        
+        .xlsx workbooks are streamed from their first sheet with openpyxl in
+        read-only mode, other formats can't be streamed and come back as one chunk.
+        """
+        usecols = list(dict.fromkeys(column_mapping.values()))
+        
+        if os.path.splitext(file_path)[1].lower() not in STREAMABLE_EXTENSIONS:
+            df = self.read_excel(file_path, usecols=usecols, dtype=self.text_dtypes(column_mapping))
+            yield self.coerce_numeric_columns(df, column_mapping)
+            return
+        
+        # Column positions from the header as pandas reads it, the labels in column_mapping
+        columns = list(pd.read_excel(file_path, nrows=0, engine='openpyxl').columns)
+        positions = [columns.index(column) for column in usecols]
+        text_columns = set(self.text_dtypes(column_mapping))
+        
+        def to_frame(chunk):
+            df = pd.DataFrame(chunk, columns=usecols)
+            # Same cells as read_excel with str dtypes: whole numbers without ".0", blanks missing
+            for column in text_columns:
+                df[column] = df[column].map(
+                    lambda value: None if value is None else str(int(value) if isinstance(value, float) and value.is_integer() else value)
+                )
+            return self.coerce_numeric_columns(df, column_mapping)
+        
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            # First sheet and first row as the header, like read_excel
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            next(rows, None)
+            
+            chunk = []
+            for row in rows:
+                chunk.append([row[position] if position < len(row) else None for position in positions])
+                if len(chunk) >= PAIRED_CHUNK_ROWS:
+                    yield to_frame(chunk)
+                    chunk = []
+            if chunk:
+                yield to_frame(chunk)
+        finally:
+            workbook.close()
+    
+    def summary_rows(self, file_path, column_mapping):
+        """(invoice, product) pairs of the summary workbook in summary format, one chunk at a time"""
+        for chunk in self.iter_chunks(file_path, column_mapping):
+            check_deadline()
+            state = self.new_invoice_summary_state()
+            self.accumulate_invoice_summary(chunk, column_mapping, state)
+            yield from zip(state['invoices'], state['products'])
+    
+    def item_invoices(self, file_path, column_mapping, products):
+        """Line items of the item report grouped by serial number, one chunk at a time
+        
+        Products are added up in products across chunks. An invoice whose
+        items span two chunks comes out once per chunk.
+        """
+        for chunk in self.iter_chunks(file_path, column_mapping):
+            check_deadline()
+            state = {'products': products, 'invoice_totals': {}, 'customer_totals': {}}
+            self.accumulate_product_detail(chunk, column_mapping, state)
+            yield from state['invoice_totals'].items()
+    
+    def new_join_state(self):
+        """Joined rows so far, filled one probe chunk at a time"""
+        return {
+            'invoices': [],
+            'products': [],
+            'customer_totals': {},
+            'matched': set(),
+            'unmatched': set()
+        }
+    
+    def add_items(self, joined, serial_number, invoice_data, party):
+        """Add an invoice's line items, attributed to the summary's party when it has one"""
+        customer_name = invoice_data['customer_name']
+        date = invoice_data['date']
+        if party is not None:
+            joined['matched'].add(serial_number)
+            customer_name = party['customer_name']
+            if date == "Unknown Date":
+                date = party['date']
+        else:
+            # Items without a summary row keep their placeholder customer
+            joined['unmatched'].add(serial_number)
+            totals = joined['customer_totals']
+            totals[customer_name] = totals.get(customer_name, 0) + invoice_data['total_amount']
+        
+        for product in invoice_data['products']:
+            joined['invoices'].append({
+                'serial_number': serial_number,
+                'customer_name': customer_name,
+                'product_name': product['product_name'],
+                'quantity': product['quantity'],
+                'tax': product['tax'],
+                'total_amount': product['total_amount'],
+                'date': date
+            })
+    
+    def add_party(self, joined, invoice, product, has_items):
+        """Add a summary invoice, as a summary line when the item report has none of its items"""
+        # The summary's totals are what each party was invoiced, charges and rounding included
+        totals = joined['customer_totals']
+        totals[invoice['customer_name']] = totals.get(invoice['customer_name'], 0) + invoice['total_amount']
+        if not has_items:
+            joined['invoices'].append(invoice)
+            joined['products'].append(product)
+    
+    def join_probing_items(self, summary_plan, items_plan):
+        """Summary as the build side, item report streamed against it"""
+        parties = {}
+        for invoice, product in self.summary_rows(*summary_plan):
+            parties[invoice['serial_number']] = (invoice, product)
+        
+        joined = self.new_join_state()
+        products = {}
+        for serial_number, invoice_data in self.item_invoices(*items_plan, products):
+            party = parties.get(serial_number)
+            self.add_items(joined, serial_number, invoice_data, party[0] if party is not None else None)
+        
+        for serial_number, (invoice, product) in parties.items():
+            self.add_party(joined, invoice, product, serial_number in joined['matched'])
+        joined['products'] = list(products.values()) + joined['products']
+        return joined
+    
+    def join_probing_summary(self, summary_plan, items_plan):
+        """Item report as the build side, summary streamed against it"""
+        products = {}
+        items = {}
+        for serial_number, invoice_data in self.item_invoices(*items_plan, products):
+            if serial_number in items:
+                # The rest of an invoice whose items spanned two chunks
+                items[serial_number]['products'].extend(invoice_data['products'])
+                items[serial_number]['total_amount'] += invoice_data['total_amount']
+            else:
+                items[serial_number] = invoice_data
+        
+        joined = self.new_join_state()
+        for invoice, product in self.summary_rows(*summary_plan):
+            serial_number = invoice['serial_number']
+            invoice_data = items.get(serial_number)
+            # A serial listed twice in the summary gets its items once
+            if invoice_data is not None and serial_number not in joined['matched']:
+                self.add_items(joined, serial_number, invoice_data, invoice)
+            self.add_party(joined, invoice, product, invoice_data is not None)
+        
+        for serial_number, invoice_data in items.items():
+            if serial_number not in joined['matched']:
+                self.add_items(joined, serial_number, invoice_data, None)
+        joined['products'] = list(products.values()) + joined['products']
+        return joined
+    
+    def parse(self, file_path: str):
+        """Join this workbook with the other one and return the result as plain data (runs in a worker process)"""
+        try:
+            plans = {}
+            for path in (file_path, self.other_path):
+                file_format, column_mapping = self.detect_format(self.read_excel(path, nrows=SNIFF_ROWS))
+                plans[file_format] = (path, column_mapping)
+            
+            if set(plans) != {'invoice_summary', 'product_detail'}:
+                return self.build_result(validation_errors=[
+                    "Paired upload needs an invoice summary workbook and its item report"
+                ])
+            
+            # Build the table from the smaller workbook, stream the larger one against it
+            summary_plan, items_plan = plans['invoice_summary'], plans['product_detail']
+            if os.path.getsize(summary_plan[0]) <= os.path.getsize(items_plan[0]):
+                joined = self.join_probing_items(summary_plan, items_plan)
+            else:
+                joined = self.join_probing_summary(summary_plan, items_plan)
+            print(f"Joined {len(joined['matched'])} invoices, {len(joined['unmatched'])} item report invoices without a summary row")
+            
+            extracted_data = {
+                'invoices': joined['invoices'],
+                'products': joined['products'],
+                'customers': self.build_customer_objects(joined['customer_totals'])
+            }
+            join_errors = []
+            if joined['unmatched']:
+                join_errors.append(f"{len(joined['unmatched'])} invoices in the item report are missing from the summary")
+            
+            # Preprocess the data
+            check_deadline()
+            extracted_data = self.preprocess_data(extracted_data)
+            
+            # Validate the data
+            validation_errors = join_errors + self.validate_data(extracted_data)
+            
+            return self.build_result(
+                invoices=extracted_data.get('invoices', []),
+                products=extracted_data.get('products', []),
+                customers=extracted_data.get('customers', []),
+                validation_errors=validation_errors
+            )
+        except Exception as e:
+            print(f"Excel file reading error: {str(e)}")
+            return self.build_result(validation_errors=[f"Error reading Excel files: {str(e)}"])
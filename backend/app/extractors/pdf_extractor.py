@@ -1,64 +1,144 @@
 import os
-import json
-import google.generativeai as genai
+import copy
+import asyncio
 from dotenv import load_dotenv
 from ..models import ExtractedData
+from ..prompts import prompt_registry
+from ..model_scheduler import model_scheduler
+from ..vendor_templates import read_pdf_lines, vendor_templates
+from ..page_cache import PDF_PAGE_CACHE, split_pages, page_key, page_cache, merge_page_results
 from .base_extractor import BaseExtractor
 
 load_dotenv()
 
+# Learn vendor layouts from model output and extract repeat layouts locally
+VENDOR_TEMPLATES = os.getenv("VENDOR_TEMPLATES", "0") == "1"
+
 class PDFExtractor(BaseExtractor):
     """Extract data from PDF files using Google Gemini"""
     
     def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-1.5-pro')
+        self.model = self.create_model_client()
+    
+    def extract_with_template(self, lines):
+        """Extract from the PDF text layer with a learned vendor template, if one fits"""
+        for template in vendor_templates.match(lines):
+            template_data = vendor_templates.apply(template, lines)
+            if not template_data:
+                continue
+            
+            template_data = self.preprocess_data(template_data)
+            validation_errors = self.validate_data(template_data)
+            if validation_errors:
+                print(f"Vendor template output failed validation: {validation_errors}")
+                continue
+            
+            return ExtractedData(
+                invoices=template_data.get('invoices', []),
+                products=template_data.get('products', []),
+                customers=template_data.get('customers', []),
+                validation_errors=[]
+            )
+        return None
+    
+    def read_with_template(self, file_path):
+        """Text layer lines of the PDF and the template result for them, if one fits (runs on a thread)"""
+        lines = read_pdf_lines(file_path)
+        return lines, self.extract_with_template(lines)
+    
+    async def extract_pages(self, file_path: str):
+        """Raw model output for a multi-page PDF, read page by page
+        
+        Pages seen before in any PDF come from the page cache, only the
+        others go to the model, concurrently. Returns None for single page
+        PDFs, which the whole-file result cache already covers.
+        """
+        pages = await asyncio.to_thread(split_pages, file_path)
+        if len(pages) < 2:
+            return None
+        
+        prompt = prompt_registry.get('pdf_page')
+        keys = [page_key(fingerprint, prompt.text, self.model.model_name) for fingerprint, _ in pages]
+        results = [page_cache.get(key) for key in keys]
+        missing = [index for index, result in enumerate(results) if result is None]
+        
+        responses = await asyncio.gather(*(
+            model_scheduler.run(
+                prompt_registry.generate, self.model, prompt, {"mime_type": "application/pdf", "data": pages[index][1]}
+            )
+            for index in missing
+        ))
+        for index, response in zip(missing, responses):
+            results[index] = self.parse_response(response)
+            await asyncio.to_thread(page_cache.put, keys[index], results[index])
+        
+        print(f"Extracted {len(pages)} pages, {len(pages) - len(missing)} from the page cache")
+        # Merging fills in cached rows, which must stay as they were stored
+        return merge_page_results(copy.deepcopy(results))
     
     async def extract(self, file_path: str) -> ExtractedData:
         # Read the PDF file
         with open(file_path, 'rb') as f:
             data = f.read()
         
-        # Process with Gemini
-        prompt = """
-        Extract the following information from this invoice PDF in JSON format:
-        1. Invoice details: serial number, date, total amount, tax
-        2. Customer details: name, phone number, address (if available)
-        3. Product details: name, quantity, unit price, tax, price with tax
+        # Repeat vendor layouts can be read from the text layer without a model call,
+        # parsing and matching are CPU bound so they run off the event loop
+        lines = []
+        if VENDOR_TEMPLATES:
+            try:
+                lines, template_result = await asyncio.to_thread(self.read_with_template, file_path)
+                if template_result:
+                    print("Extracted with a learned vendor template")
+                    return template_result
+            except Exception as e:
+                print(f"Vendor template extraction failed: {str(e)}")
         
-        Format the response as a valid JSON with three arrays: 'invoices', 'products', and 'customers'.
-        Each invoice should have: serial_number, customer_name, product_name, quantity, tax, total_amount, date
-        Each product should have: name, quantity, unit_price, tax, price_with_tax, discount (optional)
-        Each customer should have: name, phone_number, total_purchase_amount, address (optional), email (optional)
-        
-        IMPORTANT: Return ONLY the JSON object, no other text.
-        """
+        # Process with Gemini using the active prompt version for this document type
+        prompt = prompt_registry.get('pdf')
+        payload = {"mime_type": "application/pdf", "data": data}
         
         try:
-            response = self.model.generate_content([
-                prompt,
-                {"mime_type": "application/pdf", "data": data}
-            ])
+            # Multi-page PDFs can be read page by page, reusing pages seen before.
+            # Anything going wrong there, merging and preprocessing included, reads the whole PDF instead
+            extracted_json = None
+            if PDF_PAGE_CACHE:
+                try:
+                    raw_json = await self.extract_pages(file_path)
+                    if raw_json is not None:
+                        extracted_json = self.preprocess_data(copy.deepcopy(raw_json))
+                except Exception as e:
+                    print(f"Page-wise extraction failed, reading the whole PDF: {str(e)}")
             
-            # Extract JSON from the response
-            response_text = response.text
-            
-            # Clean up the response to get valid JSON
-            # Remove markdown code block indicators if present
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            # Parse the JSON
-            extracted_json = json.loads(response_text)
-            
-            # Preprocess the data
-            extracted_json = self.preprocess_data(extracted_json)
+            if extracted_json is None:
+                # On a thread, so the event loop can notice a deadline or a disconnect meanwhile,
+                # once the scheduler gives this request's priority lane a slot
+                response = await model_scheduler.run(prompt_registry.generate, self.model, prompt, payload)
+                
+                # Parse the JSON, keeping the raw output to learn from since preprocessing changes it in place
+                raw_json = self.parse_response(response)
+                
+                # Preprocess the data
+                extracted_json = self.preprocess_data(copy.deepcopy(raw_json))
             
             # Validate the data
             validation_errors = self.validate_data(extracted_json)
             
+            # Ask again for just the fields that failed validation, not the whole document
+            if validation_errors:
+                repaired_json = await self.repair(raw_json, 'pdf', payload)
+                if repaired_json is not None:
+                    raw_json = repaired_json
+                    extracted_json = self.preprocess_data(copy.deepcopy(raw_json))
+                    validation_errors = self.validate_data(extracted_json)
+            
+            # Learn this vendor's layout from a clean extraction
+            if lines and not validation_errors:
+                try:
+                    if await asyncio.to_thread(vendor_templates.learn, lines, raw_json):
+                        print("Learned a vendor template from this PDF")
+                except Exception as e:
+                    print(f"Could not learn vendor template: {str(e)}")
+            
             # Create the ExtractedData object
             return ExtractedData(
                 invoices=extracted_json.get('invoices', []),
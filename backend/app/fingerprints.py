@@ -0,0 +1,78 @@
+import hashlib
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+from .storage import JsonStore
+
+# Fingerprints not seen in an upload for this long are forgotten
+DELTA_FINGERPRINT_TTL_SECONDS = float(os.getenv("DELTA_FINGERPRINT_TTL_DAYS", "365")) * 86400
+
+# Most fingerprints kept per layout, the least recently seen are dropped first
+DELTA_MAX_FINGERPRINTS = int(os.getenv("DELTA_MAX_FINGERPRINTS", "500000"))
+
+def normalize_cell(value) -> str:
+    """Normalize a cell value so the same content always hashes the same way"""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        # 100.0 and 100 are the same amount, whatever dtype pandas inferred
+        if value.is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+def row_fingerprint(serial_number: str, values: Iterable) -> str:
+    """Build a fingerprint for a row keyed on its serial number and content"""
+    content = '\x1f'.join(normalize_cell(value) for value in values)
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    return f"{serial_number}:{digest}"
+
+class FingerprintStore:
+    """Persisted row fingerprints that have already been ingested, per layout
+    
+    Each fingerprint keeps the time it was last seen in an upload, so old
+    ones expire and every layout stays under DELTA_MAX_FINGERPRINTS.
+    """
+    
+    def __init__(self, file_name: str = "excel_fingerprints.json"):
+        self.store = JsonStore(file_name, default={})
+        self.seen: Optional[Dict[str, Dict[str, float]]] = None
+    
+    def read(self) -> Dict[str, Dict[str, float]]:
+        stored = self.store.load()
+        # Files from before fingerprints were kept per layout are started over
+        return stored if isinstance(stored, dict) else {}
+    
+    def load(self) -> Dict[str, Dict[str, float]]:
+        if self.seen is None:
+            self.seen = self.read()
+        return self.seen
+    
+    def unseen(self, layout: str, fingerprints: List[str]) -> List[bool]:
+        """Return a flag per fingerprint telling whether it is new for this layout"""
+        seen = self.load().get(layout, {})
+        return [fingerprint not in seen for fingerprint in fingerprints]
+    
+    def add(self, fingerprints: Dict[str, Iterable[str]]) -> None:
+        """Record fingerprints per layout as seen now, prune old ones and persist them"""
+        now = time.time()
+        with self.store.lock:
+            # Re-read so concurrent uploads don't overwrite each other's fingerprints
+            self.seen = self.read()
+            for layout, layout_fingerprints in fingerprints.items():
+                seen = self.seen.setdefault(layout, {})
+                seen.update(dict.fromkeys(layout_fingerprints, now))
+            
+            for layout, seen in list(self.seen.items()):
+                kept = {fingerprint: seen_at for fingerprint, seen_at in seen.items()
+                        if now - seen_at <= DELTA_FINGERPRINT_TTL_SECONDS}
+                if len(kept) > DELTA_MAX_FINGERPRINTS:
+                    newest = sorted(kept.items(), key=lambda item: item[1], reverse=True)
+                    kept = dict(newest[:DELTA_MAX_FINGERPRINTS])
+                if kept:
+                    self.seen[layout] = kept
+                else:
+                    del self.seen[layout]
+            self.store.save(self.seen)
@@ -0,0 +1,153 @@
+import io
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image, ImageOps
+
+# Images at least this many times taller than wide are read in tiles
+IMAGE_TILE_MIN_ASPECT = float(os.getenv("IMAGE_TILE_MIN_ASPECT", "2.0"))
+
+# Share of each tile's height repeated in the next tile, so no line item is only ever seen cut in half
+IMAGE_TILE_OVERLAP = float(os.getenv("IMAGE_TILE_OVERLAP", "0.25"))
+
+# Most tiles per image, taller images get taller tiles
+IMAGE_MAX_TILES = int(os.getenv("IMAGE_MAX_TILES", "6"))
+
+# Invoice fields printed once in the receipt header, the same for every line item
+HEADER_FIELDS = ['serial_number', 'date', 'customer_name']
+
+# Values for fields a tile or page left null, so merged rows fit the models. Zero amounts
+# are flagged by validation and asked for again (see BaseExtractor.repair)
+ROW_DEFAULTS = {
+    'invoices': {'serial_number': '', 'customer_name': '', 'date': 'Unknown Date', 'quantity': 1, 'tax': 0, 'total_amount': 0},
+    'products': {'name': '', 'quantity': 1, 'unit_price': 0, 'price_with_tax': 0},
+    'customers': {'total_purchase_amount': 0},
+}
+
+def plan_tiles(width: int, height: int) -> List[Tuple[int, int, int, int]]:
+    """Boxes (left, top, right, bottom) of overlapping tiles down a tall image, or [] if it isn't tall"""
+    if width <= 0 or height < width * IMAGE_TILE_MIN_ASPECT:
+        return []
+    
+    # Tiles at least as tall as wide suit the model's own image tiling, stretched to cover the image exactly
+    overlap = min(max(IMAGE_TILE_OVERLAP, 0.0), 0.5)
+    count = min(max(2, int((height / width - overlap) / (1 - overlap))), IMAGE_MAX_TILES)
+    tile_height = height / (count - (count - 1) * overlap)
+    step = tile_height * (1 - overlap)
+    
+    boxes = []
+    for index in range(count):
+        top = int(index * step)
+        bottom = height if index == count - 1 else int(top + tile_height)
+        boxes.append((0, top, width, bottom))
+    return boxes
+
+def tile_image(data: bytes) -> Optional[List[bytes]]:
+    """JPEG tiles of a tall image, or None if the image should be read whole"""
+    with Image.open(io.BytesIO(data)) as image:
+        # Phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(image)
+        boxes = plan_tiles(*image.size)
+        if not boxes:
+            return None
+        
+        image = image.convert('RGB')
+        tiles = []
+        for box in boxes:
+            buffer = io.BytesIO()
+            image.crop(box).save(buffer, format='JPEG', quality=92)
+            tiles.append(buffer.getvalue())
+        return tiles
+
+def without_nulls(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: value for field, value in row.items() if value is not None}
+
+def fill_defaults(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Default the fields merged rows still lack, in place, see ROW_DEFAULTS"""
+    for section, defaults in ROW_DEFAULTS.items():
+        for row in result.get(section) or []:
+            for field, value in defaults.items():
+                if row.get(field) is None:
+                    row[field] = value
+    return result
+
+def normalize_name(name) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', str(name or '').lower()).strip()
+
+def same_row(a: Dict[str, Any], b: Dict[str, Any], name_field: str, amount_field: str) -> bool:
+    """Whether two rows read from neighbouring tiles are the same line item
+    
+    A row cut at the tile edge may lack its amount, so a missing amount matches any.
+    """
+    if not normalize_name(a.get(name_field)) or normalize_name(a.get(name_field)) != normalize_name(b.get(name_field)):
+        return False
+    x, y = a.get(amount_field), b.get(amount_field)
+    if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+        return True
+    return round(x, 2) == round(y, 2)
+
+def merge_rows(tiles: List[List[Dict[str, Any]]], name_field: str, amount_field: str) -> List[Dict[str, Any]]:
+    """Concatenate the rows of each tile, dropping the ones repeated from the tile above
+    
+    Only rows of neighbouring tiles are compared and each row matches at most
+    once, so identical line items printed apart on the receipt are kept.
+    """
+    merged = []
+    previous = []
+    for rows in tiles:
+        unmatched = list(previous)
+        current = []
+        for row in rows:
+            match = next((index for index in unmatched if same_row(merged[index], row, name_field, amount_field)), None)
+            if match is None:
+                merged.append(row)
+                current.append(len(merged) - 1)
+                continue
+            
+            unmatched.remove(match)
+            # The tile above wins, the one below fills in what was cut off
+            merged[match] = {**row, **without_nulls(merged[match])}
+            current.append(match)
+        previous = current
+    # Fields no tile could read are left out, so preprocessing sees them as missing rather than None
+    return [without_nulls(row) for row in merged]
+
+def merge_tile_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the model's raw JSON for each tile, top to bottom, into one result for the receipt"""
+    products = merge_rows([result.get('products') or [] for result in results], 'name', 'price_with_tax')
+    invoices = merge_rows([result.get('invoices') or [] for result in results], 'product_name', 'total_amount')
+    
+    # Header fields are only visible in one tile, the topmost reading wins
+    header = {}
+    for field in HEADER_FIELDS:
+        header[field] = next(
+            (invoice[field] for result in results for invoice in result.get('invoices') or [] if invoice.get(field)),
+            None
+        )
+    # Tiles can read a name with different casing, invoices are linked to products by exact name
+    product_names = {normalize_name(product.get('name')): product.get('name') for product in products}
+    for invoice in invoices:
+        for field, value in header.items():
+            if value is not None:
+                invoice[field] = value
+        invoice['product_name'] = product_names.get(normalize_name(invoice.get('product_name')), invoice.get('product_name'))
+    
+    customers = [customer for result in results for customer in result.get('customers') or [] if customer.get('name')]
+    if not customers:
+        return fill_defaults({'invoices': invoices, 'products': products, 'customers': []})
+    
+    name = header['customer_name'] or customers[0]['name']
+    customer = dict(next((c for c in customers if normalize_name(c['name']) == normalize_name(name)), customers[0]))
+    customer['name'] = name
+    # Contact details may be printed in a different tile than the name
+    for other in customers:
+        for field, value in other.items():
+            if customer.get(field) is None and value is not None:
+                customer[field] = value
+    
+    # Each tile only saw part of the purchase, the receipt's total is the sum of its items
+    amounts = [p.get('price_with_tax') for p in products if isinstance(p.get('price_with_tax'), (int, float))]
+    if amounts:
+        customer['total_purchase_amount'] = round(sum(amounts), 2)
+    
+    return fill_defaults({'invoices': invoices, 'products': products, 'customers': [customer]})
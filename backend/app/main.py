@@ -1,17 +1,34 @@
 import os
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import math
+import time
+import asyncio
+import shutil
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from typing import List, Optional
 import uuid
 import logging
 import traceback
 
 from .models import ExtractedData
-from .extractors import PDFExtractor, ImageExtractor, ExcelExtractor
+from .extractors import PDFExtractor, ImageExtractor, ExcelExtractor, CSVExtractor, PairedExcelExtractor
 from .utils import save_upload_file, get_file_type
+from .workers import shutdown_process_pool
+from .prompts import prompt_registry
+from .results_cache import result_cache, hash_file, is_file_hash
+from .customer_index import customer_index
+from .deadlines import (
+    REQUEST_TIMEOUT_SECONDS, Deadline, DeadlineExceeded, ClientDisconnected, current_deadline, run_until_abandoned
+)
+from .model_scheduler import model_scheduler, current_caller, caller_for_request
+from .admission import AdmissionMiddleware, upload_budget, max_upload_bytes, largest_upload_bytes, reserved
 
 app = FastAPI(title="Invoice Data Extraction API")
 
+# Admit uploads against the in-flight byte budget, added before CORS so
+# rejections still carry the CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -19,45 +36,118 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],  
+    expose_headers=["Retry-After"],
 )
 
 # Create upload directory
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Chunks of large uploads are collected here until the upload completes
+CHUNK_DIR = os.path.join(UPLOAD_DIR, "chunks")
+
+# Largest chunk accepted, the frontend sends 5 MB chunks
+UPLOAD_CHUNK_BYTES = 5 * 1024 * 1024
+
+# Chunks of uploads that were never completed are removed after this long
+UPLOAD_CHUNK_TTL_SECONDS = int(os.getenv("UPLOAD_CHUNK_TTL_MINUTES", "60")) * 60
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def check_delta_supported(filename: str, delta: bool) -> None:
+    """CSV files are streamed in chunks, so the rows of an invoice can't be selected as a whole"""
+    if delta and get_file_type(filename) == 'csv':
+        raise HTTPException(status_code=400, detail="delta is not supported for CSV files, upload them without it")
+
 @app.post("/api/extract", response_model=ExtractedData)
-async def extract_data(file: UploadFile = File(...)):
+async def extract_data(request: Request, file: UploadFile = File(...), delta: bool = False,
+                       timeout: Optional[float] = None):
     """
-    Extract data from an uploaded file (PDF, image, or Excel)
+    Extract data from an uploaded file (PDF, image, Excel, or CSV/TSV)
+    
+    With delta=true, Excel rows already ingested by earlier uploads are skipped.
+    timeout shortens the server's extraction deadline in seconds
     """
+    check_delta_supported(file.filename, delta)
+    
     # Save the uploaded file
-    file_path = await save_upload_file(file, UPLOAD_DIR)
+    file_path = await save_upload_file(file, UPLOAD_DIR, max_upload_bytes(get_file_type(file.filename)))
     logger.info(f"File saved to {file_path}")
     
+    return await process_upload(file_path, file.filename, delta, request, timeout)
+
+@app.post("/api/extract/paired", response_model=ExtractedData)
+async def extract_paired(request: Request, files: List[UploadFile] = File(...), timeout: Optional[float] = None):
+    """
+    Extract data from an invoice summary workbook and its item report, joined on serial number
+    
+    The item report's line items get the party names and the customers the
+    invoice totals of the summary
+    """
+    if len(files) != 2 or any(get_file_type(file.filename) != 'excel' for file in files):
+        raise HTTPException(status_code=400, detail="Paired upload needs exactly two Excel workbooks")
+    
+    file_paths = []
+    try:
+        for file in files:
+            file_paths.append(await save_upload_file(file, UPLOAD_DIR, max_upload_bytes('excel')))
+        logger.info(f"Files saved to {file_paths}")
+        
+        extractor = PairedExcelExtractor(file_paths[0])
+        return await process_upload(file_paths[1], files[1].filename, request=request, timeout=timeout,
+                                    extractor=extractor)
+    finally:
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+async def process_upload(file_path: str, filename: str, delta: bool = False,
+                         request: Optional[Request] = None, timeout: Optional[float] = None,
+                         extractor=None) -> ExtractedData:
+    """Extract data from a saved upload, store the result by file hash and remove the file
+    
+    Extraction is cancelled when the deadline passes or the client disconnects.
+    Model calls are scheduled in the request's priority lane (X-Priority: batch
+    or ?priority=batch for bulk ingestion), fairly between clients.
+    An extractor passed in is used instead of the one for the file type
+    """
+    seconds = min(timeout, REQUEST_TIMEOUT_SECONDS) if timeout else REQUEST_TIMEOUT_SECONDS
+    deadline = Deadline(time.time() + seconds, f"{file_path}.cancelled")
+    # Set before the extraction task starts so it, its threads and its worker processes see it
+    deadline_token = current_deadline.set(deadline)
+    caller_token = current_caller.set(caller_for_request(request)) if request is not None else None
+    
+    # Delta results depend on what was ingested before, and joined results on the other file,
+    # so only full extractions of a single file are reusable
+    reusable = not delta and extractor is None
+    
     try:
         # Determine file type and use appropriate extractor
-        file_type = get_file_type(file.filename)
+        file_type = get_file_type(filename)
         logger.info(f"Detected file type: {file_type}")
         
-        if file_type == 'pdf':
+        if extractor is not None:
+            logger.info(f"Using {type(extractor).__name__}")
+        elif file_type == 'pdf':
             extractor = PDFExtractor()
             logger.info("Using PDF extractor")
         elif file_type == 'image':
             extractor = ImageExtractor()
             logger.info("Using Image extractor")
         elif file_type == 'excel':
-            extractor = ExcelExtractor()
+            extractor = ExcelExtractor(delta=delta)
             logger.info("Using Excel extractor")
+        elif file_type == 'csv':
+            extractor = CSVExtractor()
+            logger.info("Using CSV extractor")
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_type}")
         
         # Extract data
         logger.info("Starting data extraction")
-        extracted_data = await extractor.extract(file_path)
+        extracted_data = await run_until_abandoned(extractor.extract(file_path), deadline, request)
         
         # If we have validation errors but still have some data, continue processing
         if extracted_data.validation_errors and (extracted_data.invoices or extracted_data.products or extracted_data.customers):
@@ -75,9 +165,11 @@ async def extract_data(file: UploadFile = File(...)):
             if not product.id:
                 product.id = str(uuid.uuid4())
         
-        for customer in extracted_data.customers:
-            if not customer.id:
-                customer.id = str(uuid.uuid4())
+        # Purchases are kept per uploaded file, so uploading it again replaces them
+        file_hash = await asyncio.to_thread(hash_file, file_path)
+        
+        # Customers get the id of their persistent identity and its running purchase total
+        await asyncio.to_thread(customer_index.resolve, extracted_data.customers, extracted_data.invoices, file_hash)
         
         # Link invoices to products and customers
         for invoice in extracted_data.invoices:
@@ -93,17 +185,174 @@ async def extract_data(file: UploadFile = File(...)):
                     invoice.customer_id = customer.id
                     break
         
+        # Customers that resolved to the same identity are returned once
+        unique_customers = {}
+        for customer in extracted_data.customers:
+            unique_customers.setdefault(customer.id, customer)
+        extracted_data.customers = list(unique_customers.values())
+        
+        # Results with warnings aren't served again, the next upload of the file is extracted afresh
+        if reusable and not extracted_data.validation_errors:
+            await asyncio.to_thread(result_cache.put, file_hash, extracted_data.model_dump())
+        
         return extracted_data
     
+    except DeadlineExceeded:
+        logger.warning(f"Extraction of {filename} cancelled after {seconds:.0f}s deadline")
+        raise HTTPException(status_code=504, detail=f"Extraction did not finish within {seconds:.0f} seconds")
+    except ClientDisconnected:
+        logger.info(f"Client disconnected, extraction of {filename} cancelled")
+        # Nobody is listening for this response any more
+        raise HTTPException(status_code=499, detail="Client closed the request")
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
     finally:
+        current_deadline.reset(deadline_token)
+        if caller_token is not None:
+            current_caller.reset(caller_token)
+        deadline.clean_up()
         # Clean up the uploaded file
         if os.path.exists(file_path):
             os.remove(file_path)
 
+@app.get("/api/results/{file_hash}", response_model=ExtractedData)
+async def get_stored_result(file_hash: str):
+    """
+    Return the stored extraction of a file by the SHA-256 of its bytes
+    
+    Lets the client skip uploading a file that was already extracted
+    """
+    result = result_cache.get(file_hash)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No stored result for this file")
+    return result
+
+def chunk_path(file_hash: str, index: int) -> str:
+    return os.path.join(CHUNK_DIR, file_hash, f"{index:06d}.part")
+
+def max_chunks(max_bytes: int) -> int:
+    return math.ceil(max_bytes / UPLOAD_CHUNK_BYTES)
+
+def received_bytes(file_hash: str, skip_index: int) -> int:
+    """Bytes of the chunks of an upload received so far, other than skip_index"""
+    directory = os.path.join(CHUNK_DIR, file_hash)
+    if not os.path.isdir(directory):
+        return 0
+    skip = os.path.basename(chunk_path(file_hash, skip_index))
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name != skip)
+
+last_chunk_sweep = 0.0
+
+def remove_stale_chunks() -> None:
+    """Remove the chunks of uploads that were abandoned, at most once a minute"""
+    global last_chunk_sweep
+    now = time.time()
+    if now - last_chunk_sweep < 60 or not os.path.isdir(CHUNK_DIR):
+        return
+    last_chunk_sweep = now
+    for entry in os.scandir(CHUNK_DIR):
+        # A directory's mtime changes whenever a chunk is added to it
+        if entry.is_dir() and now - entry.stat().st_mtime > UPLOAD_CHUNK_TTL_SECONDS:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+@app.put("/api/uploads/{file_hash}/chunks/{index}")
+async def upload_chunk(file_hash: str, index: int, request: Request):
+    """Receive one chunk of a large file, sent as the raw request body
+    
+    The file type isn't known until the upload completes, so the chunks are
+    held to the largest per-type cap here and to the file's own cap then
+    """
+    if not is_file_hash(file_hash) or not 0 <= index < max_chunks(largest_upload_bytes()):
+        raise HTTPException(status_code=400, detail="Invalid file hash or chunk index")
+    remove_stale_chunks()
+    
+    path = chunk_path(file_hash, index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A chunk sent again replaces the earlier copy, so it doesn't count twice
+    limit = largest_upload_bytes() - received_bytes(file_hash, index)
+    size = 0
+    try:
+        with open(path, 'wb') as out_file:
+            async for block in request.stream():
+                size += len(block)
+                if size > UPLOAD_CHUNK_BYTES or size > limit:
+                    raise HTTPException(status_code=413, detail="Chunk or upload is larger than the server accepts")
+                out_file.write(block)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    
+    return {"index": index, "size": size}
+
+@app.post("/api/uploads/{file_hash}/complete", response_model=ExtractedData)
+async def complete_upload(request: Request, file_hash: str, filename: str, chunks: int, delta: bool = False,
+                          timeout: Optional[float] = None):
+    """
+    Join the uploaded chunks and extract data from the file
+    
+    The joined file must hash to file_hash, otherwise the chunks are discarded
+    and the client has to upload again
+    """
+    if not is_file_hash(file_hash) or not 0 < chunks <= max_chunks(max_upload_bytes(get_file_type(filename))):
+        raise HTTPException(status_code=400, detail="Invalid file hash or chunk count")
+    check_delta_supported(filename, delta)
+    
+    missing = [index for index in range(chunks) if not os.path.exists(chunk_path(file_hash, index))]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing chunks: {missing}")
+    
+    size = sum(os.path.getsize(chunk_path(file_hash, index)) for index in range(chunks))
+    if size > max_upload_bytes(get_file_type(filename)):
+        shutil.rmtree(os.path.join(CHUNK_DIR, file_hash), ignore_errors=True)
+        raise HTTPException(status_code=413, detail=f"{filename} is larger than the limit for this file type")
+    
+    # The chunks arrived as separate requests, so the whole file is admitted here
+    async with reserved(size):
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{os.path.splitext(filename)[1]}")
+        try:
+            with open(file_path, 'wb') as out_file:
+                for index in range(chunks):
+                    with open(chunk_path(file_hash, index), 'rb') as chunk:
+                        shutil.copyfileobj(chunk, out_file)
+        finally:
+            shutil.rmtree(os.path.join(CHUNK_DIR, file_hash), ignore_errors=True)
+        
+        if hash_file(file_path) != file_hash:
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail="Uploaded chunks do not match the file hash")
+        
+        logger.info(f"File assembled from {chunks} chunks at {file_path}")
+        return await process_upload(file_path, filename, delta, request, timeout)
+
+@app.on_event("shutdown")
+def stop_workers():
+    """Stop the spreadsheet parsing processes with the API and save unwritten prompt usage"""
+    shutdown_process_pool()
+    prompt_registry.flush_usage()
+
+@app.get("/api/prompts/stats")
+async def prompt_stats():
+    """Token usage per prompt version"""
+    return prompt_registry.stats()
+
+@app.get("/api/customers")
+async def list_customers():
+    """Customers known across all uploads, with their running purchase totals"""
+    return await asyncio.to_thread(customer_index.identities)
+
+@app.get("/api/scheduler/stats")
+async def scheduler_stats():
+    """Model calls running and queued per priority lane"""
+    return model_scheduler.stats()
+
+@app.get("/api/admission/stats")
+async def admission_stats():
+    """Upload bytes in flight against the budget, and admission counters"""
+    return upload_budget.gauges()
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
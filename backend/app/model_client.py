@@ -0,0 +1,171 @@
+import os
+import inspect
+import hashlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+import google.generativeai as genai
+from .storage import JsonStore
+from .utils import configure_gemini
+from .deadlines import check_deadline, remaining_seconds
+
+# Newer clients accept a per call timeout, older ones only have the transport default
+REQUEST_OPTIONS_SUPPORTED = 'request_options' in inspect.signature(genai.GenerativeModel.generate_content).parameters
+
+class CassetteNotFound(LookupError):
+    """Raised in replay mode when no answer was recorded for a request"""
+
+class CassetteResponse:
+    """Recorded model answer, exposes the same .text as a live response"""
+    
+    def __init__(self, text: str):
+        self.text = text
+
+def contents_key(model_name: str, contents) -> str:
+    """Hash of the model name, prompt text and payload bytes of one request"""
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict):
+            digest.update(str(part.get('mime_type')).encode('utf-8'))
+            digest.update(part.get('data') or b'')
+        else:
+            digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+def describe_contents(contents) -> list:
+    """Readable summary of a request stored next to the answer"""
+    described = []
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict):
+            data = part.get('data') or b''
+            described.append({
+                'mime_type': part.get('mime_type'),
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest()
+            })
+        else:
+            described.append(str(part))
+    return described
+
+class ModelClient(ABC):
+    """What the extractors need from a generative model
+    
+    Mirrors the parts of genai.GenerativeModel the extractors use, so a
+    client can stand in for the model without changes to the callers.
+    """
+    
+    # Server side prompt caching only makes sense against the real model
+    supports_prompt_cache = False
+    
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+    
+    @abstractmethod
+    def generate_content(self, contents) -> Any:
+        """Run a request, the result has the answer in .text"""
+        pass
+    
+    def count_tokens(self, contents) -> Any:
+        raise NotImplementedError(f"{type(self).__name__} can't count tokens")
+
+class LiveModelClient(ModelClient):
+    """Calls Gemini"""
+    
+    supports_prompt_cache = True
+    
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        configure_gemini()
+        self.model = genai.GenerativeModel(model_name)
+        # The client reports the fully qualified name, e.g. models/gemini-1.5-pro
+        self.model_name = self.model.model_name
+    
+    def generate_content(self, contents):
+        # Don't start a call the request no longer has time (or a client) for
+        check_deadline()
+        timeout = remaining_seconds()
+        if timeout is not None and REQUEST_OPTIONS_SUPPORTED:
+            return self.model.generate_content(contents, request_options={'timeout': timeout})
+        return self.model.generate_content(contents)
+    
+    def count_tokens(self, contents):
+        return self.model.count_tokens(contents)
+
+class CassetteStore:
+    """Recorded answers, one JSON file per request hash"""
+    
+    def __init__(self, directory: Optional[str] = None):
+        # Relative paths are inside DATA_DIR
+        self.directory = directory or os.getenv("CASSETTE_DIR", "cassettes")
+    
+    def store(self, key: str) -> JsonStore:
+        return JsonStore(os.path.join(self.directory, f"{key}.json"))
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        store = self.store(key)
+        if not os.path.exists(store.path):
+            return None
+        return store.load() or None
+    
+    def put(self, key: str, cassette: Dict[str, Any]) -> None:
+        store = self.store(key)
+        with store.lock:
+            store.save(cassette)
+
+class RecordingModelClient(ModelClient):
+    """Calls the wrapped client and saves every answer as a cassette"""
+    
+    def __init__(self, client: ModelClient, cassettes: CassetteStore):
+        super().__init__(client.model_name)
+        self.client = client
+        self.cassettes = cassettes
+    
+    def generate_content(self, contents):
+        response = self.client.generate_content(contents)
+        self.cassettes.put(contents_key(self.model_name, contents), {
+            'model': self.model_name,
+            'request': describe_contents(contents),
+            'text': response.text
+        })
+        return response
+    
+    def count_tokens(self, contents):
+        return self.client.count_tokens(contents)
+
+class ReplayModelClient(ModelClient):
+    """Serves recorded answers without any network access"""
+    
+    def __init__(self, model_name: str, cassettes: CassetteStore):
+        super().__init__(model_name)
+        self.cassettes = cassettes
+    
+    def generate_content(self, contents):
+        check_deadline()
+        key = contents_key(self.model_name, contents)
+        cassette = self.cassettes.get(key)
+        if cassette is None:
+            raise CassetteNotFound(
+                f"No recorded answer for request {key} in {self.cassettes.directory}, "
+                f"record one with MODEL_CLIENT_MODE=record"
+            )
+        return CassetteResponse(cassette['text'])
+
+def create_model_client(model_name: str, mode: Optional[str] = None) -> ModelClient:
+    """Model client for the configured MODEL_CLIENT_MODE
+    
+    live calls the model, record calls it and saves each answer as a
+    cassette, replay only serves saved answers. Read on every call so
+    values from .env apply.
+    """
+    mode = mode or os.getenv("MODEL_CLIENT_MODE", "live")
+    if mode == 'live':
+        return LiveModelClient(model_name)
+    
+    cassettes = CassetteStore()
+    if mode == 'record':
+        return RecordingModelClient(LiveModelClient(model_name), cassettes)
+    if mode == 'replay':
+        # Keys use the qualified name the live client reports
+        qualified_name = model_name if model_name.startswith('models/') else f"models/{model_name}"
+        return ReplayModelClient(qualified_name, cassettes)
+    raise ValueError(f"Unknown MODEL_CLIENT_MODE: {mode}")
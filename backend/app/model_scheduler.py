@@ -0,0 +1,182 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = (INTERACTIVE, BATCH)
+
+# Model calls in flight at once across both lanes
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "8"))
+
+# Slots only interactive calls may use, so a batch backlog never fills every slot
+MODEL_INTERACTIVE_RESERVED = int(os.getenv("MODEL_INTERACTIVE_RESERVED", "1"))
+
+def parse_shares(shares: str) -> Dict[str, float]:
+    """Parse shares such as 'interactive=4,batch=1', lanes left out get a share of 1"""
+    parsed = {lane: 1.0 for lane in LANES}
+    for part in shares.split(','):
+        lane, _, share = part.partition('=')
+        if lane.strip() in parsed and share.strip():
+            parsed[lane.strip()] = max(float(share), 0.01)
+    return parsed
+
+# How free slots are split while both lanes have calls waiting
+MODEL_LANE_SHARES = parse_shares(os.getenv("MODEL_LANE_SHARES", "interactive=4,batch=1"))
+
+class Caller(NamedTuple):
+    """Who a model call is made for: the priority lane and the client to be fair between"""
+    lane: str = INTERACTIVE
+    client: str = 'local'
+
+# Caller of the request being handled, set by the API for each upload
+current_caller: contextvars.ContextVar[Caller] = contextvars.ContextVar('current_caller', default=Caller())
+
+def caller_for_request(request) -> Caller:
+    """Lane from the X-Priority header or ?priority=, client from X-Client-Id or the client address"""
+    lane = request.headers.get('x-priority') or request.query_params.get('priority') or INTERACTIVE
+    if lane not in LANES:
+        lane = INTERACTIVE
+    client = request.headers.get('x-client-id') or (request.client.host if request.client else 'unknown')
+    return Caller(lane, client)
+
+class ModelScheduler:
+    """Admit model calls by priority lane, fairly between clients
+    
+    At most `concurrency` calls run at once and batch calls never take the
+    last `reserved` slots. While both lanes have calls waiting, free slots go
+    to the lanes in proportion to their shares (stride scheduling); when only
+    one lane is waiting it gets every free slot, so batch work soaks up spare
+    capacity. Within a lane, clients take turns so one client's backlog
+    doesn't hold up everyone else's calls.
+    
+    Runs on the event loop only, so no lock is needed.
+    """
+    
+    def __init__(self, concurrency: int, reserved: int, shares: Dict[str, float]):
+        self.concurrency = max(concurrency, 1)
+        self.reserved = min(max(reserved, 0), self.concurrency - 1)
+        self.shares = shares
+        self.running = {lane: 0 for lane in LANES}
+        # Per lane, the waiting calls of each client in the order clients take turns
+        self.waiting = {lane: OrderedDict() for lane in LANES}
+        self.passes = {lane: 0.0 for lane in LANES}
+        self.granted = {lane: 0 for lane in LANES}
+        self.wait_seconds = {lane: 0.0 for lane in LANES}
+        # One thread per slot, the default executor can be smaller than the concurrency
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='model-call')
+    
+    def queued(self, lane: str) -> int:
+        return sum(len(calls) for calls in self.waiting[lane].values())
+    
+    def can_start(self, lane: str) -> bool:
+        in_flight = sum(self.running.values())
+        if lane == BATCH:
+            return in_flight < self.concurrency - self.reserved
+        return in_flight < self.concurrency
+    
+    def grant(self, lane: str) -> None:
+        self.running[lane] += 1
+        self.granted[lane] += 1
+        self.passes[lane] += 1 / self.shares[lane]
+    
+    def dispatch(self) -> None:
+        """Hand free slots to waiting calls"""
+        while True:
+            lanes = [lane for lane in LANES if self.waiting[lane] and self.can_start(lane)]
+            if not lanes:
+                return
+            lane = min(lanes, key=lambda lane: self.passes[lane])
+            
+            # Next client in turn, which then goes to the back of the line
+            clients = self.waiting[lane]
+            client, calls = next(iter(clients.items()))
+            future = calls.popleft()
+            clients.pop(client)
+            if calls:
+                clients[client] = calls
+            # Skip calls cancelled while they waited
+            if future.done():
+                continue
+            
+            self.grant(lane)
+            future.set_result(None)
+    
+    async def acquire(self, caller: Caller) -> None:
+        lane = caller.lane
+        # A lane that was idle starts level with the other active lanes instead of with banked credit
+        if not self.waiting[lane] and not self.running[lane]:
+            active = [self.passes[other] for other in LANES if other != lane and (self.waiting[other] or self.running[other])]
+            if active:
+                self.passes[lane] = max(self.passes[lane], min(active))
+        
+        if not any(self.waiting.values()) and self.can_start(lane):
+            self.grant(lane)
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[lane].setdefault(caller.client, deque()).append(future)
+        # A slot may be free for this lane even though the other lane is waiting
+        self.dispatch()
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the request was abandoned, give the slot back
+                self.release(caller)
+            else:
+                calls = self.waiting[lane].get(caller.client)
+                if calls is not None and future in calls:
+                    calls.remove(future)
+                    if not calls:
+                        del self.waiting[lane][caller.client]
+            raise
+        finally:
+            self.wait_seconds[lane] += time.perf_counter() - start
+    
+    def release(self, caller: Caller) -> None:
+        self.running[caller.lane] -= 1
+        self.dispatch()
+    
+    async def run(self, func, *args):
+        """Run a blocking model call on the scheduler's threads once the current caller gets a slot
+        
+        The slot is held until the call's thread finishes, even if the request
+        is abandoned meanwhile, since the call still counts against the quota.
+        """
+        caller = current_caller.get()
+        await self.acquire(caller)
+        loop = asyncio.get_running_loop()
+        try:
+            # Copy the context so the call sees the request's deadline
+            future = self.executor.submit(contextvars.copy_context().run, func, *args)
+        except BaseException:
+            self.release(caller)
+            raise
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, caller))
+        return await asyncio.wrap_future(future)
+    
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'interactive_reserved': self.reserved,
+            'shares': self.shares,
+            'lanes': {
+                lane: {
+                    'running': self.running[lane],
+                    'queued': self.queued(lane),
+                    'waiting_clients': len(self.waiting[lane]),
+                    'granted': self.granted[lane],
+                    'avg_wait_seconds': round(self.wait_seconds[lane] / (self.granted[lane] or 1), 3),
+                }
+                for lane in LANES
+            }
+        }
+
+# Shared by all extractors in this process
+model_scheduler = ModelScheduler(MODEL_CONCURRENCY, MODEL_INTERACTIVE_RESERVED, MODEL_LANE_SHARES)
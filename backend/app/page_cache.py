@@ -0,0 +1,114 @@
+import io
+import os
+import re
+import hashlib
+from typing import Any, Dict, List, Tuple
+from PyPDF2 import PdfReader, PdfWriter
+from .results_cache import ResultCache
+from .image_tiles import HEADER_FIELDS, fill_defaults, normalize_name, without_nulls
+
+# Set to 1 to extract multi-page PDFs page by page, reusing the output of pages seen before
+PDF_PAGE_CACHE = os.getenv("PDF_PAGE_CACHE", "0") == "1"
+
+# Subset fonts get a random tag per document (ABCDEF+Arial), which says nothing about the page
+SUBSET_TAG = re.compile(r'^/?[A-Z]{6}\+')
+
+def stream_hash(stream) -> str:
+    return hashlib.sha256(stream.get_data()).hexdigest()
+
+def page_fingerprint(page) -> str:
+    """Hash of what a page shows, the same for an identical page inside any PDF
+    
+    Covers the page size, the content stream, the images it draws and the
+    character maps of its fonts, but not object numbers or document ids.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([float(value) for value in page.mediabox]).encode('utf-8'))
+    contents = page.get_contents()
+    digest.update(contents.get_data() if contents is not None else b'')
+    
+    resources = page.get('/Resources')
+    resources = resources.get_object() if resources is not None else {}
+    
+    fonts = resources.get('/Font')
+    for name, font in sorted((fonts.get_object() if fonts is not None else {}).items()):
+        font = font.get_object()
+        to_unicode = font.get('/ToUnicode')
+        described = stream_hash(to_unicode.get_object()) if to_unicode is not None else SUBSET_TAG.sub('', str(font.get('/BaseFont', '')))
+        digest.update(f"{name}:{described}".encode('utf-8'))
+    
+    xobjects = resources.get('/XObject')
+    for name, xobject in sorted((xobjects.get_object() if xobjects is not None else {}).items()):
+        digest.update(f"{name}:{stream_hash(xobject.get_object())}".encode('utf-8'))
+    
+    return digest.hexdigest()
+
+def split_pages(file_path: str) -> List[Tuple[str, bytes]]:
+    """(fingerprint, single page PDF) for each page of a PDF"""
+    reader = PdfReader(file_path)
+    pages = []
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append((page_fingerprint(page), buffer.getvalue()))
+    return pages
+
+def page_key(fingerprint: str, prompt_text: str, model_name: str) -> str:
+    """Cache key of a page's output, a new prompt wording or model extracts it again"""
+    return hashlib.sha256(f"{fingerprint}\n{model_name}\n{prompt_text}".encode('utf-8')).hexdigest()
+
+def merge_page_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the model's raw JSON for each page, in page order, into one result for the PDF
+    
+    Continuation pages don't repeat the invoice header, so their rows take
+    the serial number, date and customer of the invoice above them. Rows
+    without a product or an amount only carry the header and are dropped.
+    Fields no page could read are left out or defaulted, as for image tiles.
+    """
+    invoices = []
+    products = []
+    header = {}
+    for result in results:
+        for invoice in result.get('invoices') or []:
+            # A new serial number starts a new invoice, nothing carries over from the last one
+            if invoice.get('serial_number') and invoice['serial_number'] != header.get('serial_number'):
+                header = {}
+            for field in HEADER_FIELDS:
+                if invoice.get(field):
+                    header[field] = invoice[field]
+                elif field in header:
+                    invoice[field] = header[field]
+            
+            if invoice.get('product_name') or invoice.get('total_amount'):
+                invoices.append(without_nulls(invoice))
+        products.extend(without_nulls(product) for product in result.get('products') or [])
+    
+    # The same customer is read on several pages, keep one with the details of all
+    customers = {}
+    for result in results:
+        for customer in result.get('customers') or []:
+            if not customer.get('name'):
+                continue
+            merged = customers.setdefault(normalize_name(customer['name']), dict(customer))
+            for field, value in customer.items():
+                if merged.get(field) is None and value is not None:
+                    merged[field] = value
+    
+    # A page only saw part of the purchase, the customer's total is the sum of their invoice rows
+    referenced = {normalize_name(invoice.get('customer_name')) for invoice in invoices}
+    for key, customer in customers.items():
+        amounts = [
+            invoice['total_amount'] for invoice in invoices
+            if normalize_name(invoice.get('customer_name')) == key and isinstance(invoice.get('total_amount'), (int, float))
+        ]
+        if amounts:
+            customer['total_purchase_amount'] = round(sum(amounts), 2)
+    
+    # Placeholders read from pages that don't show the customer are dropped
+    kept = [customer for key, customer in customers.items() if key in referenced] or list(customers.values())
+    return fill_defaults({'invoices': invoices, 'products': products, 'customers': kept})
+
+# Raw model output per page, by page_key
+page_cache = ResultCache(directory="pages")
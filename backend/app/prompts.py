@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import random
+import threading
+import datetime
+from typing import Dict, List, NamedTuple, Tuple
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from .storage import JsonStore
+
+# Versioned extraction prompts, {document} is filled in per document type
+PROMPT_TEMPLATES = {
+    'v1': """
+        Extract the following information from this {document} in JSON format:
+        1. Invoice details: serial number, date, total amount, tax
+        2. Customer details: name, phone number, address (if available)
+        3. Product details: name, quantity, unit price, tax, price with tax
+        
+        Format the response as a valid JSON with three arrays: 'invoices', 'products', and 'customers'.
+        Each invoice should have: serial_number, customer_name, product_name, quantity, tax, total_amount, date
+        Each product should have: name, quantity, unit_price, tax, price_with_tax, discount (optional)
+        Each customer should have: name, phone_number, total_purchase_amount, address (optional), email (optional)
+        
+        IMPORTANT: Return ONLY the JSON object, no other text.
+        """,
+    # Trimmed wording of v1, same output schema with fewer input tokens
+    'v2': """
+        Extract the invoice data in this {document} as a JSON object with three arrays:
+        invoices: serial_number, customer_name, product_name, quantity, tax, total_amount, date
+        products: name, quantity, unit_price, tax, price_with_tax, discount
+        customers: name, phone_number, total_purchase_amount, address, email
+        Use null for missing values. Return ONLY the JSON object.
+        """,
+}
+
+# Follow-up prompt asking only for fields that failed validation, {rows} are the rows
+# concerned as first extracted and {fields} the fields to read again
+REPAIR_PROMPT_TEMPLATE = """
+        Data was extracted from this {document} as JSON, but some fields are missing or look wrong.
+        The rows concerned, as extracted:
+        {rows}
+        
+        Read only these fields again from the document:
+        {fields}
+        
+        Return ONLY a JSON object mapping each field path above to its value,
+        e.g. {{"invoices[0].serial_number": "INV-001"}}. Use null if the document doesn't show it.
+        """
+
+# How each document type is described inside the prompt
+DOCUMENT_DESCRIPTIONS = {
+    'pdf': 'invoice PDF',
+    'image': 'invoice image',
+    # One page of a multi-page PDF, see page_cache
+    'pdf_page': 'page of an invoice PDF (other pages are read separately, use null for values not on this page)',
+    # One of several overlapping sections a tall receipt photo is cut into
+    'image_tile': 'section of a long receipt image (use null for values not visible in this section)',
+}
+
+# Minutes a shared prompt prefix stays cached with the model
+PROMPT_CACHE_TTL_MINUTES = int(os.getenv("PROMPT_CACHE_TTL_MINUTES", "60"))
+
+# A cache this close to its expiry is replaced rather than used, so calls in flight don't outlive it
+PROMPT_CACHE_RENEW_SECONDS = 60
+
+# Prompt usage is written to the stats file at most this often
+PROMPT_STATS_FLUSH_SECONDS = 30
+
+def new_usage_entry():
+    return {
+        'calls': 0,
+        'prompt_tokens': 0,
+        'response_tokens': 0,
+        'response_chars': 0,
+        'template_tokens': None
+    }
+
+def merge_usage(stats, usage):
+    """Add per-version usage counts to stats (modified in place and returned)"""
+    for key, counts in usage.items():
+        entry = stats.setdefault(key, new_usage_entry())
+        for field in ('calls', 'prompt_tokens', 'response_tokens', 'response_chars'):
+            entry[field] += counts[field]
+        if counts['template_tokens'] is not None:
+            entry['template_tokens'] = counts['template_tokens']
+    return stats
+
+class Prompt(NamedTuple):
+    document_type: str
+    version: str
+    text: str
+    
+    @property
+    def key(self) -> str:
+        return f"{self.document_type}:{self.version}"
+
+class CachedModel(NamedTuple):
+    """Model bound to a server side prompt cache (None if caching isn't possible) and when that expires"""
+    model: object
+    expires_at: float
+
+class PromptRegistry:
+    """Central registry of versioned extraction prompts with token accounting
+    
+    The active version for a document type comes from PROMPT_VERSION_<TYPE>
+    (e.g. PROMPT_VERSION_PDF=v2). A comma separated list such as "v1,v2"
+    picks one at random per request, for A/B comparisons.
+    """
+    
+    def __init__(self, templates, descriptions):
+        self.templates = templates
+        self.descriptions = descriptions
+        self.stats_store = JsonStore("prompt_stats.json")
+        self.cached_models = {}
+        
+        # Usage not yet written to the stats file, see record_usage
+        self.usage_lock = threading.Lock()
+        self.pending_usage = {}
+        self.template_tokens = {}
+        self.flushed_at = time.monotonic()
+    
+    def get(self, document_type: str) -> Prompt:
+        """Return the prompt to use for a document type"""
+        configured = os.getenv(f"PROMPT_VERSION_{document_type.upper()}", "v1")
+        versions = [version.strip() for version in configured.split(',') if version.strip() in self.templates]
+        version = random.choice(versions) if versions else 'v1'
+        
+        text = self.templates[version].format(document=self.descriptions[document_type])
+        return Prompt(document_type, version, text)
+    
+    def get_repair(self, document_type: str, rows: Dict[str, dict], fields: List[Tuple[str, str]]) -> Prompt:
+        """Prompt asking again for just the given (field path, problem) pairs, with their rows as context"""
+        text = REPAIR_PROMPT_TEMPLATE.format(
+            document=self.descriptions[document_type],
+            rows=json.dumps(rows, default=str),
+            fields='\n        '.join(f"- {path}: {problem}" for path, problem in fields)
+        )
+        return Prompt(document_type, 'repair', text)
+    
+    def cached_model(self, prompt: Prompt, model_name: str):
+        """Model bound to a server side cache of the prompt, if the client supports it
+        
+        Context caching only exists in newer google-generativeai releases and
+        the model rejects prompts below its minimum cacheable size, so this
+        returns None whenever caching isn't possible.
+        """
+        if os.getenv("PROMPT_CACHE", "0") != "1" or not hasattr(genai, 'caching'):
+            return None
+        
+        key = (prompt.key, model_name)
+        cached = self.cached_models.get(key)
+        # The cache expires on the server after its TTL, create a new one before then
+        if cached is None or time.time() >= cached.expires_at - PROMPT_CACHE_RENEW_SECONDS:
+            expires_at = time.time() + PROMPT_CACHE_TTL_MINUTES * 60
+            try:
+                cache = genai.caching.CachedContent.create(
+                    model=model_name,
+                    system_instruction=prompt.text,
+                    ttl=datetime.timedelta(minutes=PROMPT_CACHE_TTL_MINUTES)
+                )
+                cached = CachedModel(genai.GenerativeModel.from_cached_content(cached_content=cache), expires_at)
+            except Exception as e:
+                # Tried again once the TTL has passed
+                print(f"Prompt caching unavailable for {prompt.key}: {str(e)}")
+                cached = CachedModel(None, expires_at)
+            self.cached_models[key] = cached
+        
+        return cached.model
+    
+    def forget_cached_model(self, prompt: Prompt, model_name: str) -> None:
+        """Drop a cache the server no longer has, the next call creates a new one"""
+        self.cached_models.pop((prompt.key, model_name), None)
+    
+    def generate(self, model, prompt: Prompt, payload):
+        """Run the prompt against the model, reusing a cached prompt prefix when available"""
+        # Repair prompts differ per document, only the versioned templates are worth caching
+        cacheable = model.supports_prompt_cache and prompt.version in self.templates
+        cached_model = self.cached_model(prompt, model.model_name) if cacheable else None
+        response = None
+        if cached_model is not None:
+            try:
+                response = cached_model.generate_content([payload])
+            except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                # Deleted or expired on the server ahead of our clock, send the prompt in full this time
+                print(f"Cached prompt for {prompt.key} is gone: {str(e)}")
+                self.forget_cached_model(prompt, model.model_name)
+        if response is None:
+            response = model.generate_content([prompt.text, payload])
+        
+        self.record_usage(model, prompt, response)
+        return response
+    
+    def count_tokens(self, model, prompt: Prompt):
+        """Tokens in the prompt text, or None if the client can't count them
+        
+        count_tokens is broken in some client releases (0.3.x passes the
+        arguments positionally), which must not stop the call being counted.
+        """
+        try:
+            return model.count_tokens(prompt.text).total_tokens
+        except Exception as e:
+            print(f"Could not count tokens for {prompt.key}: {str(e)}")
+            return None
+    
+    def record_usage(self, model, prompt: Prompt, response):
+        """Add the token counts of one call to the per-version totals
+        
+        Counts are added up in memory and merged into the stats file at most
+        every PROMPT_STATS_FLUSH_SECONDS, see flush_usage.
+        """
+        try:
+            # Older clients don't report usage, so count the template itself once per version
+            if prompt.key not in self.template_tokens:
+                stored = self.stats_store.load().get(prompt.key, {}).get('template_tokens')
+                self.template_tokens[prompt.key] = stored if stored is not None else self.count_tokens(model, prompt)
+            
+            usage = getattr(response, 'usage_metadata', None)
+            with self.usage_lock:
+                entry = self.pending_usage.setdefault(prompt.key, new_usage_entry())
+                entry['calls'] += 1
+                entry['response_chars'] += len(response.text)
+                entry['template_tokens'] = self.template_tokens[prompt.key]
+                if usage is not None:
+                    entry['prompt_tokens'] += usage.prompt_token_count
+                    entry['response_tokens'] += usage.candidates_token_count
+                due = time.monotonic() - self.flushed_at >= PROMPT_STATS_FLUSH_SECONDS
+            
+            if due:
+                self.flush_usage()
+        except Exception as e:
+            # Accounting must never break an extraction
+            print(f"Could not record prompt usage for {prompt.key}: {str(e)}")
+    
+    def flush_usage(self):
+        """Merge the counts recorded since the last flush into the stats file"""
+        with self.usage_lock:
+            pending, self.pending_usage = self.pending_usage, {}
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        
+        with self.stats_store.lock:
+            # Re-read so other processes' counts are kept
+            stats = merge_usage(self.stats_store.load(), pending)
+            self.stats_store.save(stats)
+    
+    def stats(self):
+        """Token usage per prompt version, with per-call averages"""
+        with self.usage_lock:
+            stats = merge_usage(self.stats_store.load(), self.pending_usage)
+        for entry in stats.values():
+            calls = entry['calls'] or 1
+            entry['avg_prompt_tokens'] = round(entry['prompt_tokens'] / calls, 1)
+            entry['avg_response_tokens'] = round(entry['response_tokens'] / calls, 1)
+        return stats
+
+# Shared by all extractors
+prompt_registry = PromptRegistry(PROMPT_TEMPLATES, DOCUMENT_DESCRIPTIONS)
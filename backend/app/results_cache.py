@@ -0,0 +1,95 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+from .storage import DATA_DIR, JsonStore
+
+# SHA-256 hex digest of the uploaded bytes
+FILE_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+# Stored results not used for this long are removed
+RESULT_CACHE_MAX_AGE_SECONDS = float(os.getenv("RESULT_CACHE_MAX_AGE_DAYS", "30")) * 86400
+
+# Most results kept per cache directory, the least recently used are removed first
+RESULT_CACHE_MAX_FILES = int(os.getenv("RESULT_CACHE_MAX_FILES", "10000"))
+
+# Seconds between sweeps of a cache directory
+SWEEP_INTERVAL_SECONDS = 60
+
+def is_file_hash(value: str) -> bool:
+    return bool(FILE_HASH.match(value))
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, the same digest the frontend computes before uploading"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResultCache:
+    """Extraction results stored by the hash of the uploaded file
+    
+    Lets a client check whether identical bytes were already extracted
+    before uploading them again. Each result is its own file so lookups
+    never load the whole cache. A file's mtime is when it was last used,
+    which sweep uses to keep the cache within its age and size bounds.
+    """
+    
+    def __init__(self, directory: str = "results"):
+        self.directory = directory
+        self.sweep_lock = threading.Lock()
+        self.last_sweep = 0.0
+    
+    def store(self, file_hash: str) -> JsonStore:
+        return JsonStore(os.path.join(self.directory, f"{file_hash}.json"))
+    
+    def get(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        if not is_file_hash(file_hash):
+            return None
+        store = self.store(file_hash)
+        try:
+            age = time.time() - os.path.getmtime(store.path)
+            if age > RESULT_CACHE_MAX_AGE_SECONDS:
+                os.remove(store.path)
+                return None
+            os.utime(store.path)
+        except OSError:
+            return None
+        return store.load() or None
+    
+    def put(self, file_hash: str, result: Dict[str, Any]) -> None:
+        store = self.store(file_hash)
+        with store.lock:
+            store.save(result)
+        self.sweep()
+    
+    def sweep(self) -> None:
+        """Remove expired results, then the least recently used beyond RESULT_CACHE_MAX_FILES (at most once a minute)"""
+        with self.sweep_lock:
+            now = time.time()
+            if now - self.last_sweep < SWEEP_INTERVAL_SECONDS:
+                return
+            self.last_sweep = now
+        
+        directory = os.path.join(DATA_DIR, self.directory)
+        entries = []
+        try:
+            for entry in os.scandir(directory):
+                if entry.name.endswith('.json'):
+                    entries.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return
+        
+        entries.sort(reverse=True)
+        for index, (mtime, path) in enumerate(entries):
+            if index >= RESULT_CACHE_MAX_FILES or now - mtime > RESULT_CACHE_MAX_AGE_SECONDS:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+# Shared by all requests
+result_cache = ResultCache()
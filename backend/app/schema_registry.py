@@ -0,0 +1,46 @@
+import hashlib
+from typing import Any, Dict, Iterable, Optional
+from .storage import JsonStore
+
+def header_fingerprint(columns: Iterable) -> str:
+    """Fingerprint a header row so files with the same layout share one column plan"""
+    normalized = '\x1f'.join(str(column).strip().lower() for column in columns)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+class SchemaRegistry:
+    """Persisted registry of compiled column plans keyed by header fingerprint
+    
+    A plan is a dict with the detected 'format' and the 'mapping' from our
+    expected column names to the columns of the spreadsheet.
+    """
+    
+    def __init__(self, file_name: str = "schema_registry.json"):
+        self.store = JsonStore(file_name)
+        self.plans: Optional[Dict[str, Any]] = None
+    
+    def load(self) -> Dict[str, Any]:
+        if self.plans is None:
+            self.plans = self.store.load()
+        return self.plans
+    
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        plan = self.load().get(fingerprint)
+        if plan is None:
+            # Worker processes keep their own copy, the API process may have saved the plan since
+            self.plans = self.store.load()
+            plan = self.plans.get(fingerprint)
+        return plan
+    
+    def put(self, fingerprint: str, plan: Dict[str, Any]) -> None:
+        self.put_many({fingerprint: plan})
+    
+    def put_many(self, plans: Dict[str, Any]) -> None:
+        """Save plans, only called from the API process so there is a single writer"""
+        with self.store.lock:
+            # Re-read so plans saved by other requests are kept
+            self.plans = self.store.load()
+            self.plans.update(plans)
+            self.store.save(self.plans)
+
+# Shared by all extractor instances so plans survive between requests in memory too
+schema_registry = SchemaRegistry()
@@ -0,0 +1,49 @@
+import os
+import json
+import threading
+import tempfile
+from typing import Any
+
+# Directory used for data that must survive between uploads (fingerprints, caches, indexes)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# One lock per file, shared by every store instance pointing at it
+_locks = {}
+_locks_guard = threading.Lock()
+
+def get_lock(path: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+class JsonStore:
+    """Small JSON file backed store for state that must persist between uploads"""
+    
+    def __init__(self, file_name: str, default: Any = None):
+        self.path = os.path.join(DATA_DIR, file_name)
+        self.default = default if default is not None else {}
+        self.lock = get_lock(self.path)
+    
+    def load(self) -> Any:
+        """Load the stored value, falling back to the default if missing or unreadable"""
+        if not os.path.exists(self.path):
+            return json.loads(json.dumps(self.default))
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {self.path}: {str(e)}")
+            return json.loads(json.dumps(self.default))
+    
+    def save(self, value: Any) -> None:
+        """Write the value atomically so a crash never leaves a half written file"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -1,10 +1,35 @@
 import os
 import uuid
-from fastapi import UploadFile
+from typing import Optional
+from fastapi import UploadFile, HTTPException
 import aiofiles
+import google.generativeai as genai
 
-async def save_upload_file(upload_file: UploadFile, destination: str) -> str:
-    """Save an uploaded file to the specified destination."""
+def configure_gemini():
+    """Configure the Gemini client from the environment
+    
+    GEMINI_API_ENDPOINT points the client at another server speaking the
+    Gemini REST API, such as the load-test stand-in in loadtest/.
+    """
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(
+            api_key=os.getenv("GEMINI_API_KEY"),
+            transport="rest",
+            client_options={"api_endpoint": endpoint}
+        )
+    else:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+# Block size used when copying uploads to disk
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+async def save_upload_file(upload_file: UploadFile, destination: str, max_bytes: Optional[int] = None) -> str:
+    """Save an uploaded file to the specified destination.
+    
+    The file is copied in blocks so it is never held in memory whole. Files
+    larger than max_bytes are rejected with a 413.
+    """
     # Create destination directory if it doesn't exist
     os.makedirs(destination, exist_ok=True)
     
@@ -14,9 +39,24 @@ async def save_upload_file(upload_file: UploadFile, destination: str) -> str:
     file_path = os.path.join(destination, unique_filename)
     
     # Save the file
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        content = await upload_file.read()
-        await out_file.write(content)
+    size = 0
+    try:
+        async with aiofiles.open(file_path, 'wb') as out_file:
+            while True:
+                block = await upload_file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes is not None and size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"{upload_file.filename} is larger than the {max_bytes // (1024 * 1024)} MB limit for this file type"
+                    )
+                await out_file.write(block)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
     
     return file_path
 
@@ -30,5 +70,7 @@ def get_file_type(filename: str) -> str:
         return 'image'
     elif extension in ['.xlsx', '.xls']:
         return 'excel'
+    elif extension in ['.csv', '.tsv']:
+        return 'csv'
     else:
         return 'unknown' 
\ No newline at end of file
@@ -0,0 +1,322 @@
+import re
+import hashlib
+from typing import Any, Dict, List, Optional
+from PyPDF2 import PdfReader
+from .storage import JsonStore
+
+# Lines at the top of a document (the vendor header block) used to fingerprint its layout
+LAYOUT_LINES = 8
+
+# Templates kept per layout fingerprint (a vendor can have several table layouts)
+MAX_TEMPLATES_PER_LAYOUT = 5
+
+# Invoice level text fields located by the label next to them
+TEXT_FIELDS = ['serial_number', 'date', 'customer_name', 'phone_number']
+
+# Line item fields located inside the item rows
+ITEM_FIELDS = ['quantity', 'unit_price', 'tax', 'price_with_tax']
+
+NUMBER_TEXT = re.compile(r'\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?')
+
+def read_pdf_lines(file_path: str) -> List[str]:
+    """Read the text layer of a PDF as a list of non-empty lines"""
+    reader = PdfReader(file_path)
+    lines = []
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        lines.extend(line.strip() for line in text.split('\n'))
+    return [line for line in lines if line]
+
+def layout_fingerprint(lines: List[str]) -> str:
+    """Fingerprint the vendor header block with the variable digits masked out"""
+    head = [re.sub(r'\d+', '#', ' '.join(line.split())) for line in lines[:LAYOUT_LINES]]
+    return hashlib.sha1('\n'.join(head).encode('utf-8')).hexdigest()
+
+def parse_number(text: str) -> float:
+    return float(text.replace(',', ''))
+
+def find_number(text: str, value: float, start: int = 0, taken=()):
+    """Find the span of a number in text, even when numbers are glued together
+    
+    Returns (start, end, decimals) of the first match at or after start, or None.
+    """
+    for i in range(start, len(text)):
+        if not text[i].isdigit():
+            continue
+        
+        best = None
+        for j in range(i + 1, min(len(text), i + 20) + 1):
+            candidate = text[i:j]
+            if any(i < e and j > s for s, e in taken) or not NUMBER_TEXT.fullmatch(candidate):
+                continue
+            decimals = len(candidate.split('.')[1]) if '.' in candidate else 0
+            # Match at the precision printed in the document
+            if abs(parse_number(candidate) - value) < 0.5 * 10 ** -max(decimals, 2):
+                best = (i, j, decimals)
+        
+        if best:
+            return best
+    return None
+
+def generalize(segment: str) -> str:
+    """Turn text around the learned fields into a pattern: numbers vary, labels don't"""
+    pattern = ''
+    for run in re.findall(r'\d[\d,.]*|\s+|[^\d\s]+', segment):
+        if run[0].isdigit():
+            pattern += r'[\d,.]*'
+        elif run.isspace():
+            pattern += r'\s*'
+        else:
+            pattern += re.escape(run)
+    return pattern
+
+def label_before(text: str) -> str:
+    """Trailing label of a text, e.g. 'Invoice Date:' from 'INV-148CZSInvoice Date:'"""
+    label = re.split(r'\d', text)[-1]
+    # The text layer glues a value to the next label, cut at the last such join
+    return re.split(r'(?<=[A-Z0-9])(?=[A-Z][a-z])', label)[-1].strip()
+
+def learn_text_rule(lines: List[str], value) -> Optional[Dict[str, Any]]:
+    """Learn the label that precedes a value, on the same line or the line above"""
+    if not value:
+        return None
+    value = str(value).strip()
+    
+    for i, line in enumerate(lines):
+        position = line.find(value)
+        if position == -1:
+            continue
+        
+        # First word after the value marks where it ends
+        following = line[position + len(value):].split()
+        suffix = following[0] if following else None
+        
+        anchor = label_before(line[:position])
+        if anchor:
+            return {'anchor': anchor, 'offset': 0, 'suffix': suffix}
+        if position == 0 and i > 0 and label_before(lines[i - 1]):
+            return {'anchor': label_before(lines[i - 1]), 'offset': 1, 'suffix': suffix}
+    return None
+
+def apply_text_rule(lines: List[str], rule: Dict[str, Any]) -> Optional[str]:
+    for i, line in enumerate(lines):
+        if rule['offset'] == 0:
+            position = line.find(rule['anchor'])
+            if position == -1:
+                continue
+            rest = line[position + len(rule['anchor']):]
+        else:
+            if not line.endswith(rule['anchor']) or i + 1 >= len(lines):
+                continue
+            rest = lines[i + 1]
+        
+        if rule['suffix']:
+            end = rest.find(rule['suffix'], 1)
+            if end > 0:
+                rest = rest[:end]
+        
+        value = rest.strip()
+        if value:
+            return value
+    return None
+
+def learn_item_rule(lines: List[str], product: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Learn a row pattern for the item table from one product the model extracted"""
+    name = str(product.get('name') or '').strip()
+    if not name:
+        return None
+    name_pattern = r'\s*'.join(re.escape(word) for word in name.split())
+    
+    for i, line in enumerate(lines):
+        match = re.search(name_pattern, line)
+        if not match:
+            continue
+        
+        # Rows wrapped onto the next line are read as one
+        for row in [line, f"{line} {lines[i + 1]}" if i + 1 < len(lines) else None]:
+            if row is None:
+                continue
+            
+            spans = {}
+            taken = []
+            for field in ITEM_FIELDS:
+                value = product.get(field)
+                if not isinstance(value, (int, float)) or value == 0:
+                    continue
+                found = find_number(row, float(value), match.end(), taken)
+                if found:
+                    spans[field] = found
+                    taken.append(found[:2])
+            
+            if 'quantity' not in spans or 'price_with_tax' not in spans:
+                continue
+            
+            # Build the row pattern: name group, field groups, generalized text in between
+            pattern = '^' + generalize(row[:match.start()]) + '(?P<name>.+?)'
+            position = match.end()
+            for field, (start, end, decimals) in sorted(spans.items(), key=lambda item: item[1][0]):
+                number = r'\d[\d,]*\.\d{%d}' % decimals if decimals else r'\d[\d,]*'
+                pattern += generalize(row[position:start]) + f'(?P<{field}>{number})'
+                position = end
+            pattern += generalize(row[position:]) + '$'
+            
+            return {
+                'start_anchor': lines[i - 1] if i > 0 else None,
+                'pattern': pattern
+            }
+    return None
+
+def match_item_rows(lines: List[str], rule: Dict[str, Any]):
+    """Read the item rows that follow the table header
+    
+    Returns the products and the index of the line after the last row. When
+    the rule knows where the table ends, every line up to there must be a
+    row, otherwise None is returned: a row we can't read means the template
+    doesn't fit this document.
+    """
+    start = 0
+    if rule['start_anchor'] is not None:
+        if rule['start_anchor'] not in lines:
+            return None, None
+        start = lines.index(rule['start_anchor']) + 1
+    
+    pattern = re.compile(rule['pattern'])
+    end_pattern = re.compile(rule['end_pattern']) if rule.get('end_pattern') else None
+    
+    products = []
+    last_row_end = start
+    i = start
+    while i < len(lines):
+        if end_pattern and end_pattern.match(lines[i]):
+            return products, i
+        
+        match = pattern.match(lines[i])
+        step = 1
+        if not match and i + 1 < len(lines):
+            match = pattern.match(f"{lines[i]} {lines[i + 1]}")
+            step = 2
+        
+        if match:
+            product = {'name': ' '.join(match.group('name').split())}
+            for field in ITEM_FIELDS:
+                if field in match.groupdict():
+                    product[field] = parse_number(match.group(field))
+            products.append(product)
+            i += step
+            last_row_end = i
+        elif end_pattern:
+            return None, None
+        else:
+            i += 1
+    
+    if end_pattern:
+        return None, None
+    return products, last_row_end
+
+class VendorTemplates:
+    """Learned vendor layouts for extracting repeat PDFs from the text layer
+    
+    After a successful model extraction the labels around each field and a
+    pattern for the item rows are recorded per layout fingerprint. Later PDFs
+    with the same layout can then be extracted locally.
+    """
+    
+    def __init__(self, file_name: str = "vendor_templates.json"):
+        self.store = JsonStore(file_name)
+    
+    def match(self, lines: List[str]) -> List[Dict[str, Any]]:
+        """Templates learned for this document's layout"""
+        templates = self.store.load().get(layout_fingerprint(lines), [])
+        return [
+            template for template in templates
+            if template['items']['start_anchor'] is None or template['items']['start_anchor'] in lines
+        ]
+    
+    def apply(self, template: Dict[str, Any], lines: List[str]) -> Optional[Dict[str, Any]]:
+        """Extract data shaped like the model's raw JSON output, or None if nothing was found"""
+        values = {field: apply_text_rule(lines, rule) for field, rule in template['fields'].items()}
+        items, _ = match_item_rows(lines, template['items'])
+        if not items:
+            return None
+        
+        serial_number = values.get('serial_number')
+        customer_name = values.get('customer_name') or f"Customer for {serial_number}"
+        
+        invoices = []
+        for item in items:
+            invoices.append({
+                'serial_number': serial_number,
+                'customer_name': customer_name,
+                'product_name': item['name'],
+                'quantity': item.get('quantity', 1),
+                'tax': item.get('tax', 0),
+                'total_amount': item['price_with_tax'],
+                'date': values.get('date') or "Unknown Date"
+            })
+        
+        return {
+            'invoices': invoices,
+            'products': items,
+            'customers': [{
+                'name': customer_name,
+                'phone_number': values.get('phone_number'),
+                'total_purchase_amount': round(sum(item['price_with_tax'] for item in items), 2),
+                'address': None,
+                'email': None
+            }]
+        }
+    
+    def learn(self, lines: List[str], data: Dict[str, Any]) -> bool:
+        """Learn a template from the model's raw output for this document
+        
+        The template is only kept if applying it to the same document
+        reproduces the products the model found.
+        """
+        invoices = data.get('invoices') or []
+        products = data.get('products') or []
+        customers = data.get('customers') or []
+        if not invoices or not products:
+            return False
+        
+        sources = {
+            'serial_number': invoices[0].get('serial_number'),
+            'date': invoices[0].get('date'),
+            'customer_name': invoices[0].get('customer_name'),
+            'phone_number': customers[0].get('phone_number') if customers else None
+        }
+        fields = {}
+        for field in TEXT_FIELDS:
+            rule = learn_text_rule(lines, sources[field])
+            if rule:
+                fields[field] = rule
+        
+        items = next((rule for rule in (learn_item_rule(lines, product) for product in products) if rule), None)
+        if 'serial_number' not in fields or items is None:
+            return False
+        
+        # Remember the line that ends the item table so unreadable rows are detected later
+        _, table_end = match_item_rows(lines, items)
+        if table_end is None or table_end >= len(lines):
+            return False
+        items['end_pattern'] = '^' + generalize(lines[table_end]) + '$'
+        
+        template = {'fields': fields, 'items': items}
+        
+        # Self check against the model's own answer
+        local = self.apply(template, lines)
+        expected = [(' '.join(str(p.get('name')).split()), round(float(p.get('price_with_tax') or 0), 2)) for p in products]
+        if not local or [(p['name'], round(p['price_with_tax'], 2)) for p in local['products']] != expected:
+            return False
+        
+        fingerprint = layout_fingerprint(lines)
+        with self.store.lock:
+            templates = self.store.load()
+            layout_templates = templates.setdefault(fingerprint, [])
+            if template not in layout_templates:
+                layout_templates.insert(0, template)
+                del layout_templates[MAX_TEMPLATES_PER_LAYOUT:]
+                self.store.save(templates)
+        return True
+
+# Shared by all PDF extractors
+vendor_templates = VendorTemplates()
@@ -0,0 +1,68 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .deadlines import current_deadline
+
+# Number of worker processes for CPU-bound parsing, 0 runs the work on a thread instead
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Create the shared process pool on first use"""
+    global _pool
+    if _pool is None:
+        # spawn instead of fork: the API process has gRPC and event loop threads
+        # that must not be copied into the children
+        _pool = ProcessPoolExecutor(
+            max_workers=PROCESS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+def run_counted(call, deadline):
+    """Run call on a thread, counting it as a worker call of the deadline"""
+    try:
+        return call()
+    finally:
+        deadline.worker_finished()
+
+async def run_in_process(func, *args, **kwargs):
+    """Run a picklable function in the process pool without blocking the event loop
+    
+    The function and its result cross a process boundary, so keep both to
+    plain Python data (dicts, lists, strings, numbers).
+    
+    Cancelling the await doesn't stop the worker, the request's cancel
+    marker does (see Deadline), so the marker is kept until the call ends.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    deadline = current_deadline.get()
+    
+    if PROCESS_POOL_WORKERS <= 0:
+        if deadline is None:
+            return await loop.run_in_executor(None, call)
+        deadline.worker_started()
+        return await loop.run_in_executor(None, run_counted, call, deadline)
+    
+    try:
+        future = get_process_pool().submit(call)
+        if deadline is not None:
+            deadline.worker_started()
+            future.add_done_callback(lambda _: deadline.worker_finished())
+        return await asyncio.wrap_future(future)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory), start a fresh pool for the next request
+        shutdown_process_pool()
+        raise
+
+def shutdown_process_pool():
+    """Stop the worker processes, called when the API shuts down"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,96 @@
+"""Offline benchmark and regression check of the extraction pipeline
+
+Runs every sample file through the same path as /api/extract (extractor,
+JSON cleanup, preprocess_data, validate_data, linking) with the model
+answers served from recorded cassettes, times each file and compares the
+results with a saved snapshot.
+
+Record the cassettes once against the real model, then replay:
+    MODEL_CLIENT_MODE=record python -m loadtest.pipeline --snapshot pipeline_snapshot.json
+    MODEL_CLIENT_MODE=replay python -m loadtest.pipeline --compare pipeline_snapshot.json --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+from .run import DEFAULT_SAMPLES_DIR, UPLOAD_KINDS, find_samples
+
+# Generated per run, so left out of the comparison
+GENERATED_FIELDS = {'id', 'product_id', 'customer_id'}
+
+def comparable(result):
+    """Extraction result without the generated ids"""
+    return {
+        key: [
+            {field: value for field, value in item.items() if field not in GENERATED_FIELDS}
+            for item in items
+        ] if key != 'validation_errors' else items
+        for key, items in result.items()
+    }
+
+async def extract_file(path: str):
+    """Run one file through the API's extraction path and return the result and seconds taken"""
+    from app.main import UPLOAD_DIR, process_upload
+    
+    # process_upload removes the file when done, so work on a copy
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, copy_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    shutil.copyfile(path, copy_path)
+    
+    start = time.perf_counter()
+    result = await process_upload(copy_path, os.path.basename(path))
+    return result.model_dump(), time.perf_counter() - start
+
+async def run(paths, repeat: int):
+    results = {}
+    timings = {}
+    for path in paths:
+        name = os.path.relpath(path, DEFAULT_SAMPLES_DIR) if path.startswith(DEFAULT_SAMPLES_DIR) else path
+        seconds = []
+        for _ in range(repeat):
+            result, elapsed = await extract_file(path)
+            seconds.append(elapsed)
+        results[name] = comparable(result)
+        timings[name] = seconds
+    return results, timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--samples', default=DEFAULT_SAMPLES_DIR, help="directory searched for sample files")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per file, the best time is reported")
+    parser.add_argument('--snapshot', help="write the results to this file")
+    parser.add_argument('--compare', help="compare the results with this snapshot, exit 1 on differences")
+    args = parser.parse_args()
+    
+    samples = find_samples(args.samples)
+    paths = [path for kind in UPLOAD_KINDS for path in samples[kind]]
+    results, timings = asyncio.run(run(paths, args.repeat))
+    
+    print(f"{'seconds':>8}  file")
+    for name, seconds in timings.items():
+        errors = results[name]['validation_errors']
+        print(f"{min(seconds):>8.3f}  {name}" + (f"  ({len(errors)} validation errors)" if errors else ''))
+    print(f"{sum(min(seconds) for seconds in timings.values()):>8.3f}  total")
+    
+    if args.snapshot:
+        with open(args.snapshot, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            expected = json.load(f)
+        changed = sorted(name for name in set(expected) | set(results) if expected.get(name) != results.get(name))
+        for name in changed:
+            print(f"Changed: {name}")
+        if changed:
+            sys.exit(1)
+        print("Results match the snapshot")
+
+if __name__ == "__main__":
+    main()
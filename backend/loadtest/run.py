@@ -0,0 +1,266 @@
+"""Load test for the extraction API
+
+Starts the Gemini stand-in and the API as subprocesses, then drives
+/api/extract with a mix of PDF, image and Excel uploads at increasing
+concurrency and reports throughput, tail latency and error rates per level.
+
+Run from the backend directory:
+    python -m loadtest.run --concurrency 1,2,4,8,16 --median 2.0 --quota-error-rate 0.05
+
+With --batch-share part of the uploads is sent in the batch priority lane,
+and latency is also reported per lane.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SAMPLES_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'test_cases')
+
+# File extensions making up each kind of upload in the mix
+UPLOAD_KINDS = {
+    'pdf': ['.pdf'],
+    'image': ['.jpg', '.jpeg', '.png'],
+    'excel': ['.xlsx', '.xls'],
+}
+
+def find_samples(samples_dir: str):
+    """Sample files per upload kind"""
+    samples = {kind: [] for kind in UPLOAD_KINDS}
+    for path in sorted(glob.glob(os.path.join(samples_dir, '**', '*'), recursive=True)):
+        extension = os.path.splitext(path)[1].lower()
+        for kind, extensions in UPLOAD_KINDS.items():
+            if extension in extensions:
+                samples[kind].append(path)
+    return samples
+
+def parse_mix(mix: str):
+    """Parse a mix such as 'pdf=5,image=2,excel=3' into weights"""
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in UPLOAD_KINDS:
+            raise ValueError(f"Unknown upload kind in mix: {kind}")
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+def multipart_body(file_path: str):
+    boundary = uuid.uuid4().hex
+    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(file_path)}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def upload(api_url: str, file_path: str, timeout: float, headers=None):
+    """Post one file and classify the outcome
+    
+    Returns (seconds, outcome) where outcome is 'ok', 'extraction_failed'
+    (HTTP 200 but nothing extracted, e.g. after a quota error or a truncated
+    response) or 'http_<status>' / 'transport_error'.
+    """
+    body, content_type = multipart_body(file_path)
+    request = urllib.request.Request(
+        f"{api_url}/api/extract", data=body, method='POST',
+        headers={'Content-Type': content_type, **(headers or {})}
+    )
+    
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = json.loads(response.read())
+        outcome = 'ok' if (data.get('invoices') or data.get('products') or data.get('customers')) else 'extraction_failed'
+    except urllib.error.HTTPError as e:
+        outcome = f"http_{e.code}"
+    except (urllib.error.URLError, OSError):
+        outcome = 'transport_error'
+    return time.perf_counter() - start, outcome
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def lane_headers(lane: str, client: int):
+    return {'X-Priority': lane, 'X-Client-Id': f"loadtest-{lane}-{client}"}
+
+def run_level(api_url: str, files, concurrency: int, requests: int, timeout: float, callers=None):
+    """Send a batch of uploads with a fixed number in flight
+    
+    callers optionally gives the (lane, client number) each upload is sent as.
+    """
+    callers = callers or [('interactive', 0)] * requests
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda args: upload(api_url, args[0], timeout, lane_headers(*args[1])),
+            zip(files[:requests], callers)
+        ))
+    elapsed = time.perf_counter() - start
+    
+    latencies = [seconds for seconds, outcome in results if outcome == 'ok']
+    lanes = {}
+    for (seconds, outcome), (lane, _) in zip(results, callers):
+        if outcome == 'ok':
+            lanes.setdefault(lane, []).append(seconds)
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput': round(len(results) / elapsed, 2),
+        'p50': round(percentile(latencies, 0.50), 3),
+        'p95': round(percentile(latencies, 0.95), 3),
+        'p99': round(percentile(latencies, 0.99), 3),
+        'max': round(max(latencies), 3) if latencies else 0.0,
+        'error_rate': round(1 - outcomes.get('ok', 0) / len(results), 4),
+        'outcomes': outcomes,
+        'lanes': {
+            lane: {'requests': len(values), 'p50': round(percentile(values, 0.50), 3), 'p95': round(percentile(values, 0.95), 3)}
+            for lane, values in sorted(lanes.items())
+        },
+    }
+
+def wait_until_up(url: str, process, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+def print_report(levels):
+    header = f"{'conc':>5} {'reqs':>5} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'errors':>7}  outcomes"
+    print(header)
+    print('-' * len(header))
+    for level in levels:
+        outcomes = ', '.join(f"{name}={count}" for name, count in sorted(level['outcomes'].items()))
+        print(
+            f"{level['concurrency']:>5} {level['requests']:>5} {level['throughput']:>7} "
+            f"{level['p50']:>7} {level['p95']:>7} {level['p99']:>7} {level['max']:>7} "
+            f"{level['error_rate']:>7.1%}  {outcomes}"
+        )
+        if len(level['lanes']) > 1:
+            for lane, stats in level['lanes'].items():
+                print(f"{'':>5} {stats['requests']:>5} {lane:>7} {stats['p50']:>7} {stats['p95']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help="comma separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=0,
+                        help="uploads per level, defaults to 4x the concurrency (at least 20)")
+    parser.add_argument('--mix', default='pdf=5,image=2,excel=3', help="relative share of each upload kind")
+    parser.add_argument('--samples', default=DEFAULT_SAMPLES_DIR, help="directory searched for sample files")
+    parser.add_argument('--api-port', type=int, default=8765)
+    parser.add_argument('--stub-port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn workers for the API")
+    parser.add_argument('--timeout', type=float, default=300.0, help="per request timeout in seconds")
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--median', type=float, default=2.0)
+    parser.add_argument('--spread', type=float, default=0.5)
+    parser.add_argument('--quota-error-rate', type=float, default=0.0)
+    parser.add_argument('--truncate-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None, help="seed for the upload mix")
+    parser.add_argument('--batch-share', type=float, default=0.0,
+                        help="fraction of uploads sent in the batch priority lane")
+    parser.add_argument('--batch-clients', type=int, default=1, help="distinct clients sending the batch uploads")
+    parser.add_argument('--json', dest='json_path', help="also write the report as JSON to this file")
+    args = parser.parse_args()
+    
+    weights = parse_mix(args.mix)
+    samples = find_samples(args.samples)
+    kinds = [kind for kind in weights if samples[kind]]
+    if not kinds:
+        sys.exit(f"No sample files for {', '.join(weights)} under {args.samples}")
+    rng = random.Random(args.seed)
+    
+    stub = subprocess.Popen([
+        sys.executable, '-m', 'loadtest.stub_gemini',
+        '--port', str(args.stub_port),
+        '--latency', args.latency,
+        '--median', str(args.median),
+        '--spread', str(args.spread),
+        '--quota-error-rate', str(args.quota_error_rate),
+        '--truncate-rate', str(args.truncate_rate),
+    ], cwd=BACKEND_DIR)
+    
+    # Fresh persisted state so caches from earlier runs don't skew the numbers
+    data_dir = tempfile.mkdtemp(prefix='loadtest-data-')
+    env = dict(
+        os.environ,
+        GEMINI_API_KEY='loadtest',
+        GEMINI_API_ENDPOINT=f"http://127.0.0.1:{args.stub_port}",
+        DATA_DIR=data_dir,
+    )
+    api = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'app.main:app',
+        '--host', '127.0.0.1', '--port', str(args.api_port),
+        '--workers', str(args.workers), '--log-level', 'warning',
+    ], cwd=BACKEND_DIR, env=env)
+    
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.stub_port}/stats", stub)
+        wait_until_up(f"{api_url}/api/health", api)
+        
+        levels = []
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            requests = args.requests or max(20, 4 * concurrency)
+            files = [
+                rng.choice(samples[rng.choices(kinds, weights=[weights[kind] for kind in kinds])[0]])
+                for _ in range(requests)
+            ]
+            callers = [
+                ('batch', rng.randrange(args.batch_clients)) if rng.random() < args.batch_share else ('interactive', 0)
+                for _ in range(requests)
+            ]
+            print(f"Running {requests} uploads at concurrency {concurrency}...", flush=True)
+            levels.append(run_level(api_url, files, concurrency, requests, args.timeout, callers))
+        
+        print()
+        print_report(levels)
+        
+        with urllib.request.urlopen(f"http://127.0.0.1:{args.stub_port}/stats") as response:
+            print(f"\nModel stand-in: {json.loads(response.read())}")
+        with urllib.request.urlopen(f"{api_url}/api/scheduler/stats") as response:
+            print(f"Model scheduler: {json.loads(response.read())}")
+        
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump({'settings': vars(args), 'levels': levels}, f, indent=2)
+    finally:
+        api.terminate()
+        stub.terminate()
+        api.wait()
+        stub.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
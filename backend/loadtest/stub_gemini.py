@@ -0,0 +1,111 @@
+"""Local stand-in for the Gemini REST API used by the load test
+
+Answers generateContent and countTokens after a simulated latency, and can
+be told to fail a share of calls with quota errors (429) or to cut the
+response text short, the way an overloaded or truncated model call looks
+to the extractors.
+
+Run with: python -m loadtest.stub_gemini --port 8090 --latency lognormal --median 2.0
+"""
+import json
+import math
+import random
+import asyncio
+import argparse
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Canned extraction returned for every document, shaped like a real model answer
+CANNED_EXTRACTION = {
+    "invoices": [
+        {"serial_number": "INV-1001", "customer_name": "Load Test Customer", "product_name": "Widget",
+         "quantity": 2, "tax": 36.0, "total_amount": 236.0, "date": "12 Nov 2024"},
+        {"serial_number": "INV-1001", "customer_name": "Load Test Customer", "product_name": "Gadget",
+         "quantity": 1, "tax": 9.0, "total_amount": 59.0, "date": "12 Nov 2024"}
+    ],
+    "products": [
+        {"name": "Widget", "quantity": 2, "unit_price": 100.0, "tax": 18, "price_with_tax": 236.0, "discount": None},
+        {"name": "Gadget", "quantity": 1, "unit_price": 50.0, "tax": 18, "price_with_tax": 59.0, "discount": None}
+    ],
+    "customers": [
+        {"name": "Load Test Customer", "phone_number": "9999999999", "total_purchase_amount": 295.0,
+         "address": None, "email": None}
+    ]
+}
+
+def latency_sampler(distribution: str, median: float, spread: float):
+    """Return a function drawing one simulated model latency in seconds"""
+    if distribution == 'fixed':
+        return lambda: median
+    if distribution == 'uniform':
+        return lambda: random.uniform(max(0.0, median - spread), median + spread)
+    if distribution == 'lognormal':
+        # median is exp(mu), spread is sigma: 0.5 gives a p99 about 3x the median
+        return lambda: random.lognormvariate(math.log(median), spread)
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+def create_app(distribution: str = 'lognormal', median: float = 2.0, spread: float = 0.5,
+               quota_error_rate: float = 0.0, truncate_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Gemini stand-in")
+    sample_latency = latency_sampler(distribution, median, spread)
+    counters = {'calls': 0, 'quota_errors': 0, 'truncated': 0}
+    
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        await request.body()
+        counters['calls'] += 1
+        
+        if random.random() < quota_error_rate:
+            # Quota errors come back quickly, before any generation happens
+            counters['quota_errors'] += 1
+            return JSONResponse(status_code=429, content={"error": {
+                "code": 429,
+                "message": "Resource has been exhausted (e.g. check quota).",
+                "status": "RESOURCE_EXHAUSTED"
+            }})
+        
+        await asyncio.sleep(sample_latency())
+        
+        text = "```json\n" + json.dumps(CANNED_EXTRACTION, indent=2) + "\n```"
+        finish_reason = "STOP"
+        if random.random() < truncate_rate:
+            counters['truncated'] += 1
+            text = text[:random.randint(1, len(text) // 2)]
+            finish_reason = "MAX_TOKENS"
+        
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": finish_reason,
+                "index": 0
+            }]
+        }
+    
+    @app.post("/v1beta/models/{model}:countTokens")
+    async def count_tokens(model: str, request: Request):
+        body = await request.body()
+        return {"totalTokens": max(1, len(body) // 4)}
+    
+    @app.get("/stats")
+    async def stats():
+        return counters
+    
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--median', type=float, default=2.0, help="median model latency in seconds")
+    parser.add_argument('--spread', type=float, default=0.5,
+                        help="uniform: +/- seconds around the median, lognormal: sigma")
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help="share of responses cut short")
+    args = parser.parse_args()
+    
+    app = create_app(args.latency, args.median, args.spread, args.quota_error_rate, args.truncate_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import pytest
+from app.customer_index import CustomerIndex
+from app.models import Customer, Invoice
+
+@pytest.fixture
+def index(tmp_path):
+    customer_index = CustomerIndex()
+    customer_index.path = str(tmp_path / "customer_index.sqlite3")
+    return customer_index
+
+def upload(index, document, rows):
+    """Resolve one extraction of (serial number, customer name, amount) rows, return the customers by name"""
+    invoices = [
+        Invoice(serial_number=serial_number, customer_name=name, tax=0, total_amount=amount, date="2024-11-11")
+        for serial_number, name, amount in rows
+    ]
+    totals = {}
+    for _, name, amount in rows:
+        totals[name] = totals.get(name, 0) + amount
+    customers = [Customer(name=name, total_purchase_amount=total) for name, total in totals.items()]
+    index.resolve(customers, invoices, document)
+    return {customer.name: customer for customer in customers}
+
+def test_same_file_again_is_not_counted_twice(index):
+    upload(index, "week1", [("INV-1", "Alice", 100), ("INV-2", "Alice", 100)])
+    customers = upload(index, "week1", [("INV-1", "Alice", 100), ("INV-2", "Alice", 100)])
+    assert customers["Alice"].total_purchase_amount == 200
+
+def test_overlapping_exports_count_shared_invoices_once(index):
+    week1 = upload(index, "week1", [("INV-1", "Alice", 100), ("INV-2", "Alice", 100)])
+    assert week1["Alice"].total_purchase_amount == 200
+    
+    # The second export repeats INV-2 and adds INV-3
+    week2 = upload(index, "week2", [("INV-2", "Alice", 100), ("INV-3", "Alice", 100)])
+    assert week2["Alice"].id == week1["Alice"].id
+    assert week2["Alice"].total_purchase_amount == 300
+
+def test_item_report_of_summarized_invoices_is_not_counted_again(index):
+    summary = upload(index, "summary", [("INV-1", "Alice", 100), ("INV-2", "Alice", 100), ("INV-3", "Alice", 100)])
+    assert summary["Alice"].total_purchase_amount == 300
+    
+    # The item report has no party names, its invoices carry placeholder customers
+    items = upload(index, "items", [
+        ("INV-1", "Customer for INV-1", 100),
+        ("INV-2", "Customer for INV-2", 100),
+        ("INV-3", "Customer for INV-3", 100)
+    ])
+    assert {customer.id for customer in items.values()} == {summary["Alice"].id}
+    assert items["Customer for INV-3"].total_purchase_amount == 300
+    assert [identity['total_purchase_amount'] for identity in index.identities()] == [300]
+
+def test_changed_amount_replaces_the_earlier_one(index):
+    upload(index, "week1", [("INV-1", "Alice", 100)])
+    customers = upload(index, "week2", [("INV-1", "Alice", 150)])
+    assert customers["Alice"].total_purchase_amount == 150
+
+def test_same_serial_for_different_customers_counts_for_each(index):
+    # Serial numbers repeat across vendors
+    upload(index, "vendor_a", [("INV-1", "Alice", 100)])
+    customers = upload(index, "vendor_b", [("INV-1", "Bob", 50)])
+    assert customers["Bob"].total_purchase_amount == 50
+    assert sorted(identity['total_purchase_amount'] for identity in index.identities()) == [50, 100]
@@ -0,0 +1,53 @@
+import asyncio
+from app.model_scheduler import BATCH, INTERACTIVE, Caller, ModelScheduler
+
+def new_scheduler(concurrency=1):
+    return ModelScheduler(concurrency, 0, {INTERACTIVE: 4.0, BATCH: 1.0})
+
+async def call(scheduler, caller, order):
+    await scheduler.acquire(caller)
+    order.append(caller.lane)
+    scheduler.release(caller)
+
+def test_returning_lane_does_not_starve_the_busy_one():
+    async def scenario():
+        scheduler = new_scheduler()
+        interactive = Caller(INTERACTIVE, 'web')
+        batch = Caller(BATCH, 'nightly')
+        
+        # A long stretch of interactive-only traffic
+        for _ in range(400):
+            await scheduler.acquire(interactive)
+            scheduler.release(interactive)
+        
+        # Batch work arrives while an interactive call runs, more interactive calls queue behind it
+        await scheduler.acquire(interactive)
+        order = []
+        tasks = [asyncio.create_task(call(scheduler, batch, order)) for _ in range(50)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(call(scheduler, interactive, order)) for _ in range(5)]
+        await asyncio.sleep(0)
+        scheduler.release(interactive)
+        await asyncio.gather(*tasks)
+        return order
+    
+    order = asyncio.run(scenario())
+    assert len(order) == 55
+    # All five interactive calls get through within the first few grants, not after the batch backlog
+    last_interactive = max(index for index, lane in enumerate(order) if lane == INTERACTIVE)
+    assert last_interactive < 10
+
+def test_lane_keeps_its_pass_when_no_other_lane_is_active():
+    async def scenario():
+        scheduler = new_scheduler()
+        for _ in range(8):
+            await scheduler.acquire(Caller(INTERACTIVE))
+            scheduler.release(Caller(INTERACTIVE))
+        
+        await scheduler.acquire(Caller(BATCH))
+        return scheduler.passes
+    
+    passes = asyncio.run(scenario())
+    assert passes[INTERACTIVE] == 2.0
+    # Only its own grant, it was not raised to the idle interactive lane's pass
+    assert passes[BATCH] == 1.0
@@ -1,13 +1,6 @@
 import React, { useState } from 'react';
 import { useSelector, useDispatch } from 'react-redux';
 import {
-  Table,
-  TableBody,
-  TableCell,
-  TableContainer,
-  TableHead,
-  TableRow,
-  Paper,
   Typography,
   Box,
   CircularProgress,
@@ -23,24 +16,22 @@ import {
 } from '@mui/material';
 import SearchIcon from '@mui/icons-material/Search';
 import EditIcon from '@mui/icons-material/Edit';
-import { updateCustomer } from '../redux/slices/customerSlice';
+import { updateCustomer, selectFilteredCustomers, selectCustomerCount, selectCustomerById } from '../redux/slices/customerSlice';
 import { updateInvoiceByCustomerId } from '../redux/slices/invoiceSlice';
+import VirtualizedTable from './VirtualizedTable';
 
 const CustomersTab = () => {
-  const { customers, loading, error } = useSelector((state) => state.customers);
+  const loading = useSelector((state) => state.customers.loading);
+  const error = useSelector((state) => state.customers.error);
+  const customerCount = useSelector(selectCustomerCount);
   const dispatch = useDispatch();
   const [searchTerm, setSearchTerm] = useState('');
   const [editCustomer, setEditCustomer] = useState(null);
   const [editDialogOpen, setEditDialogOpen] = useState(false);
 
-  // Filter customers based on search term
-  const filteredCustomers = customers.filter((customer) => {
-    const searchTermLower = searchTerm.toLowerCase();
-    return (
-      customer.name.toLowerCase().includes(searchTermLower) ||
-      (customer.phone_number && customer.phone_number.includes(searchTerm))
-    );
-  });
+  // Filter customers based on search term (memoized selector)
+  const filteredCustomers = useSelector((state) => selectFilteredCustomers(state, searchTerm));
+  const originalCustomer = useSelector((state) => (editCustomer ? selectCustomerById(state, editCustomer.id) : null));
 
   const handleEditClick = (customer) => {
     setEditCustomer({ ...customer });
@@ -56,7 +47,7 @@ const CustomersTab = () => {
     dispatch(updateCustomer(editCustomer));
     
     // Update related invoices if customer name changed
-    if (editCustomer.name !== customers.find(c => c.id === editCustomer.id).name) {
+    if (originalCustomer && editCustomer.name !== originalCustomer.name) {
       dispatch(updateInvoiceByCustomerId({
         customerId: editCustomer.id,
         customerName: editCustomer.name
@@ -75,6 +66,27 @@ const CustomersTab = () => {
     });
   };
 
+  const columns = [
+    { key: 'name', label: 'Name' },
+    { key: 'phone_number', label: 'Phone Number', render: (customer) => customer.phone_number || 'N/A' },
+    { key: 'total_purchase_amount', label: 'Total Purchase Amount' },
+    { key: 'email', label: 'Email', render: (customer) => customer.email || 'N/A' },
+    { key: 'address', label: 'Address', render: (customer) => customer.address || 'N/A' },
+    {
+      key: 'actions',
+      label: 'Actions',
+      render: (customer) => (
+        <IconButton 
+          size="small" 
+          color="primary"
+          onClick={() => handleEditClick(customer)}
+        >
+          <EditIcon />
+        </IconButton>
+      )
+    }
+  ];
+
   if (loading) {
     return (
       <Box sx={{ display: 'flex', justifyContent: 'center', p: 3 }}>
@@ -110,45 +122,12 @@ const CustomersTab = () => {
         />
       </Box>
 
-      {customers.length === 0 ? (
+      {customerCount === 0 ? (
         <Typography variant="body1" sx={{ textAlign: 'center', p: 3 }}>
           No customers found. Upload an invoice file to get started.
         </Typography>
       ) : (
-        <TableContainer component={Paper}>
-          <Table>
-            <TableHead>
-              <TableRow>
-                <TableCell>Name</TableCell>
-                <TableCell>Phone Number</TableCell>
-                <TableCell>Total Purchase Amount</TableCell>
-                <TableCell>Email</TableCell>
-                <TableCell>Address</TableCell>
-                <TableCell>Actions</TableCell>
-              </TableRow>
-            </TableHead>
-            <TableBody>
-              {filteredCustomers.map((customer) => (
-                <TableRow key={customer.id}>
-                  <TableCell>{customer.name}</TableCell>
-                  <TableCell>{customer.phone_number || 'N/A'}</TableCell>
-                  <TableCell>{customer.total_purchase_amount}</TableCell>
-                  <TableCell>{customer.email || 'N/A'}</TableCell>
-                  <TableCell>{customer.address || 'N/A'}</TableCell>
-                  <TableCell>
-                    <IconButton 
-                      size="small" 
-                      color="primary"
-                      onClick={() => handleEditClick(customer)}
-                    >
-                      <EditIcon />
-                    </IconButton>
-                  </TableCell>
-                </TableRow>
-              ))}
-            </TableBody>
-          </Table>
-        </TableContainer>
+        <VirtualizedTable columns={columns} rows={filteredCustomers} />
       )}
 
       {/* Edit Dialog */}
@@ -1,13 +1,14 @@
 import React, { useState, useCallback } from 'react';
 import { useDispatch } from 'react-redux';
 import { useDropzone } from 'react-dropzone';
-import { uploadAndExtractData } from '../redux/thunks';
+import { uploadAndExtractData, uploadAndExtractPairedData } from '../redux/thunks';
 import { 
   Box, 
   Typography, 
   Button, 
   Paper, 
   CircularProgress,
+  LinearProgress,
   Alert,
   List,
   ListItem,
@@ -15,19 +16,36 @@ import {
 } from '@mui/material';
 import CloudUploadIcon from '@mui/icons-material/CloudUpload';
 
+const PROGRESS_LABELS = {
+  hashing: 'Checking for an earlier extraction...',
+  uploading: 'Uploading',
+  extracting: 'Extracting data...',
+  waiting: 'Server is busy, retrying shortly...'
+};
+
+// An invoice summary and its item report can be dropped together to be joined
+const isWorkbook = (file) => /\.xlsx?$/i.test(file.name);
+
 const FileUpload = () => {
   const dispatch = useDispatch();
   const [loading, setLoading] = useState(false);
   const [errors, setErrors] = useState([]);
+  const [progress, setProgress] = useState(null);
   
   const onDrop = useCallback(async (acceptedFiles) => {
     if (acceptedFiles.length === 0) return;
+    if (acceptedFiles.length > 1 && !acceptedFiles.every(isWorkbook)) {
+      setErrors(['Only an invoice summary workbook and its item report can be uploaded together']);
+      return;
+    }
     
     setLoading(true);
     setErrors([]);
     
     try {
-      const validationErrors = await dispatch(uploadAndExtractData(acceptedFiles[0]));
+      const validationErrors = acceptedFiles.length > 1
+        ? await dispatch(uploadAndExtractPairedData(acceptedFiles, setProgress))
+        : await dispatch(uploadAndExtractData(acceptedFiles[0], setProgress));
       if (validationErrors && validationErrors.length > 0) {
         setErrors(validationErrors);
       }
@@ -35,6 +53,7 @@ const FileUpload = () => {
       setErrors([error.message || 'Error uploading file']);
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   }, [dispatch]);
   
@@ -45,9 +64,11 @@ const FileUpload = () => {
       'image/jpeg': ['.jpg', '.jpeg'],
       'image/png': ['.png'],
       'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': ['.xlsx'],
-      'application/vnd.ms-excel': ['.xls']
+      'application/vnd.ms-excel': ['.xls'],
+      'text/csv': ['.csv'],
+      'text/tab-separated-values': ['.tsv']
     },
-    maxFiles: 1
+    maxFiles: 2
   });
   
   return (
@@ -71,11 +92,27 @@ const FileUpload = () => {
           {isDragActive ? 'Drop the file here' : 'Drag & drop a file here, or click to select'}
         </Typography>
         <Typography variant="body2" color="textSecondary">
-          Supported formats: PDF, JPG, PNG, XLSX, XLS
+          Supported formats: PDF, JPG, PNG, XLSX, XLS, CSV, TSV
         </Typography>
-        {loading && (
-          <Box sx={{ mt: 2, display: 'flex', justifyContent: 'center' }}>
+        <Typography variant="body2" color="textSecondary">
+          Drop an invoice summary workbook together with its item report to match line items to customers
+        </Typography>
+        {loading && progress?.stage === 'uploading' && (
+          <Box sx={{ mt: 2 }}>
+            <LinearProgress variant="determinate" value={progress.percent} />
+            <Typography variant="body2" color="textSecondary" sx={{ mt: 1 }}>
+              {PROGRESS_LABELS.uploading} {progress.percent}%
+            </Typography>
+          </Box>
+        )}
+        {loading && progress?.stage !== 'uploading' && (
+          <Box sx={{ mt: 2, display: 'flex', flexDirection: 'column', alignItems: 'center' }}>
             <CircularProgress size={24} />
+            {progress && (
+              <Typography variant="body2" color="textSecondary" sx={{ mt: 1 }}>
+                {PROGRESS_LABELS[progress.stage]}
+              </Typography>
+            )}
           </Box>
         )}
       </Paper>
@@ -1,13 +1,6 @@
 import React, { useState } from 'react';
 import { useSelector, useDispatch } from 'react-redux';
 import {
-  Table,
-  TableBody,
-  TableCell,
-  TableContainer,
-  TableHead,
-  TableRow,
-  Paper,
   Typography,
   Box,
   CircularProgress,
@@ -23,24 +16,20 @@ import {
 } from '@mui/material';
 import SearchIcon from '@mui/icons-material/Search';
 import EditIcon from '@mui/icons-material/Edit';
-import { updateInvoice } from '../redux/slices/invoiceSlice';
+import { updateInvoice, selectFilteredInvoices, selectInvoiceCount } from '../redux/slices/invoiceSlice';
+import VirtualizedTable from './VirtualizedTable';
 
 const InvoicesTab = () => {
-  const { invoices, loading, error } = useSelector((state) => state.invoices);
+  const loading = useSelector((state) => state.invoices.loading);
+  const error = useSelector((state) => state.invoices.error);
+  const invoiceCount = useSelector(selectInvoiceCount);
   const dispatch = useDispatch();
   const [searchTerm, setSearchTerm] = useState('');
   const [editInvoice, setEditInvoice] = useState(null);
   const [editDialogOpen, setEditDialogOpen] = useState(false);
 
-  // Filter invoices based on search term
-  const filteredInvoices = invoices.filter((invoice) => {
-    const searchTermLower = searchTerm.toLowerCase();
-    return (
-      invoice.serial_number.toLowerCase().includes(searchTermLower) ||
-      invoice.customer_name.toLowerCase().includes(searchTermLower) ||
-      invoice.product_name.toLowerCase().includes(searchTermLower)
-    );
-  });
+  // Filter invoices based on search term (memoized selector)
+  const filteredInvoices = useSelector((state) => selectFilteredInvoices(state, searchTerm));
 
   const handleEditClick = (invoice) => {
     setEditInvoice({ ...invoice });
@@ -68,6 +57,29 @@ const InvoicesTab = () => {
     });
   };
 
+  const columns = [
+    { key: 'serial_number', label: 'Serial Number' },
+    { key: 'customer_name', label: 'Customer Name' },
+    { key: 'product_name', label: 'Product Name' },
+    { key: 'quantity', label: 'Quantity' },
+    { key: 'tax', label: 'Tax' },
+    { key: 'total_amount', label: 'Total Amount' },
+    { key: 'date', label: 'Date' },
+    {
+      key: 'actions',
+      label: 'Actions',
+      render: (invoice) => (
+        <IconButton 
+          size="small" 
+          color="primary"
+          onClick={() => handleEditClick(invoice)}
+        >
+          <EditIcon />
+        </IconButton>
+      )
+    }
+  ];
+
   if (loading) {
     return (
       <Box sx={{ display: 'flex', justifyContent: 'center', p: 3 }}>
@@ -103,49 +115,12 @@ const InvoicesTab = () => {
         />
       </Box>
 
-      {invoices.length === 0 ? (
+      {invoiceCount === 0 ? (
         <Typography variant="body1" sx={{ textAlign: 'center', p: 3 }}>
           No invoices found. Upload an invoice file to get started.
         </Typography>
       ) : (
-        <TableContainer component={Paper}>
-          <Table>
-            <TableHead>
-              <TableRow>
-                <TableCell>Serial Number</TableCell>
-                <TableCell>Customer Name</TableCell>
-                <TableCell>Product Name</TableCell>
-                <TableCell>Quantity</TableCell>
-                <TableCell>Tax</TableCell>
-                <TableCell>Total Amount</TableCell>
-                <TableCell>Date</TableCell>
-                <TableCell>Actions</TableCell>
-              </TableRow>
-            </TableHead>
-            <TableBody>
-              {filteredInvoices.map((invoice) => (
-                <TableRow key={invoice.id}>
-                  <TableCell>{invoice.serial_number}</TableCell>
-                  <TableCell>{invoice.customer_name}</TableCell>
-                  <TableCell>{invoice.product_name}</TableCell>
-                  <TableCell>{invoice.quantity}</TableCell>
-                  <TableCell>{invoice.tax}</TableCell>
-                  <TableCell>{invoice.total_amount}</TableCell>
-                  <TableCell>{invoice.date}</TableCell>
-                  <TableCell>
-                    <IconButton 
-                      size="small" 
-                      color="primary"
-                      onClick={() => handleEditClick(invoice)}
-                    >
-                      <EditIcon />
-                    </IconButton>
-                  </TableCell>
-                </TableRow>
-              ))}
-            </TableBody>
-          </Table>
-        </TableContainer>
+        <VirtualizedTable columns={columns} rows={filteredInvoices} />
       )}
 
       {/* Edit Dialog */}
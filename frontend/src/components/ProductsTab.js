@@ -1,13 +1,6 @@
 import React, { useState } from 'react';
 import { useSelector, useDispatch } from 'react-redux';
 import {
-  Table,
-  TableBody,
-  TableCell,
-  TableContainer,
-  TableHead,
-  TableRow,
-  Paper,
   Typography,
   Box,
   CircularProgress,
@@ -23,21 +16,22 @@ import {
 } from '@mui/material';
 import SearchIcon from '@mui/icons-material/Search';
 import EditIcon from '@mui/icons-material/Edit';
-import { updateProduct } from '../redux/slices/productSlice';
+import { updateProduct, selectFilteredProducts, selectProductCount, selectProductById } from '../redux/slices/productSlice';
 import { updateInvoiceByProductId } from '../redux/slices/invoiceSlice';
+import VirtualizedTable from './VirtualizedTable';
 
 const ProductsTab = () => {
-  const { products, loading, error } = useSelector((state) => state.products);
+  const loading = useSelector((state) => state.products.loading);
+  const error = useSelector((state) => state.products.error);
+  const productCount = useSelector(selectProductCount);
   const dispatch = useDispatch();
   const [searchTerm, setSearchTerm] = useState('');
   const [editProduct, setEditProduct] = useState(null);
   const [editDialogOpen, setEditDialogOpen] = useState(false);
 
-  // Filter products based on search term
-  const filteredProducts = products.filter((product) => {
-    const searchTermLower = searchTerm.toLowerCase();
-    return product.name.toLowerCase().includes(searchTermLower);
-  });
+  // Filter products based on search term (memoized selector)
+  const filteredProducts = useSelector((state) => selectFilteredProducts(state, searchTerm));
+  const originalProduct = useSelector((state) => (editProduct ? selectProductById(state, editProduct.id) : null));
 
   const handleEditClick = (product) => {
     setEditProduct({ ...product });
@@ -53,7 +47,7 @@ const ProductsTab = () => {
     dispatch(updateProduct(editProduct));
     
     // Update related invoices if product name changed
-    if (editProduct.name !== products.find(p => p.id === editProduct.id).name) {
+    if (originalProduct && editProduct.name !== originalProduct.name) {
       dispatch(updateInvoiceByProductId({
         productId: editProduct.id,
         productName: editProduct.name
@@ -74,6 +68,28 @@ const ProductsTab = () => {
     });
   };
 
+  const columns = [
+    { key: 'name', label: 'Name' },
+    { key: 'quantity', label: 'Quantity' },
+    { key: 'unit_price', label: 'Unit Price' },
+    { key: 'tax', label: 'Tax' },
+    { key: 'price_with_tax', label: 'Price with Tax' },
+    { key: 'discount', label: 'Discount', render: (product) => product.discount || 0 },
+    {
+      key: 'actions',
+      label: 'Actions',
+      render: (product) => (
+        <IconButton 
+          size="small" 
+          color="primary"
+          onClick={() => handleEditClick(product)}
+        >
+          <EditIcon />
+        </IconButton>
+      )
+    }
+  ];
+
   if (loading) {
     return (
       <Box sx={{ display: 'flex', justifyContent: 'center', p: 3 }}>
@@ -109,47 +125,12 @@ const ProductsTab = () => {
         />
       </Box>
 
-      {products.length === 0 ? (
+      {productCount === 0 ? (
         <Typography variant="body1" sx={{ textAlign: 'center', p: 3 }}>
           No products found. Upload an invoice file to get started.
         </Typography>
       ) : (
-        <TableContainer component={Paper}>
-          <Table>
-            <TableHead>
-              <TableRow>
-                <TableCell>Name</TableCell>
-                <TableCell>Quantity</TableCell>
-                <TableCell>Unit Price</TableCell>
-                <TableCell>Tax</TableCell>
-                <TableCell>Price with Tax</TableCell>
-                <TableCell>Discount</TableCell>
-                <TableCell>Actions</TableCell>
-              </TableRow>
-            </TableHead>
-            <TableBody>
-              {filteredProducts.map((product) => (
-                <TableRow key={product.id}>
-                  <TableCell>{product.name}</TableCell>
-                  <TableCell>{product.quantity}</TableCell>
-                  <TableCell>{product.unit_price}</TableCell>
-                  <TableCell>{product.tax}</TableCell>
-                  <TableCell>{product.price_with_tax}</TableCell>
-                  <TableCell>{product.discount || 0}</TableCell>
-                  <TableCell>
-                    <IconButton 
-                      size="small" 
-                      color="primary"
-                      onClick={() => handleEditClick(product)}
-                    >
-                      <EditIcon />
-                    </IconButton>
-                  </TableCell>
-                </TableRow>
-              ))}
-            </TableBody>
-          </Table>
-        </TableContainer>
+        <VirtualizedTable columns={columns} rows={filteredProducts} />
       )}
 
       {/* Edit Dialog */}
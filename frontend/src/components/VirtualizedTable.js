@@ -0,0 +1,65 @@
+import React, { useState } from 'react';
+import {
+  Table,
+  TableBody,
+  TableCell,
+  TableContainer,
+  TableHead,
+  TableRow,
+  Paper
+} from '@mui/material';
+
+// Fixed row height of a small MUI table row holding an icon button
+const ROW_HEIGHT = 48;
+
+// Extra rows rendered above and below the visible window to keep scrolling smooth
+const OVERSCAN = 10;
+
+// Renders only the rows inside the scroll window, so large results stay responsive
+const VirtualizedTable = ({ columns, rows, height = 600, rowHeight = ROW_HEIGHT }) => {
+  const [scrollTop, setScrollTop] = useState(0);
+
+  const firstRow = Math.max(0, Math.floor(scrollTop / rowHeight) - OVERSCAN);
+  const lastRow = Math.min(rows.length, firstRow + Math.ceil(height / rowHeight) + 2 * OVERSCAN);
+  const visibleRows = rows.slice(firstRow, lastRow);
+
+  // Spacer rows stand in for the rows that are not rendered
+  const renderSpacer = (rowCount) => (
+    <TableRow style={{ height: rowCount * rowHeight }}>
+      <TableCell colSpan={columns.length} sx={{ p: 0, border: 0 }} />
+    </TableRow>
+  );
+
+  return (
+    <TableContainer
+      component={Paper}
+      sx={{ maxHeight: height }}
+      onScroll={(e) => setScrollTop(e.currentTarget.scrollTop)}
+    >
+      <Table stickyHeader size="small">
+        <TableHead>
+          <TableRow>
+            {columns.map((column) => (
+              <TableCell key={column.key}>{column.label}</TableCell>
+            ))}
+          </TableRow>
+        </TableHead>
+        <TableBody>
+          {firstRow > 0 && renderSpacer(firstRow)}
+          {visibleRows.map((row) => (
+            <TableRow key={row.id} style={{ height: rowHeight }}>
+              {columns.map((column) => (
+                <TableCell key={column.key} sx={{ whiteSpace: 'nowrap' }}>
+                  {column.render ? column.render(row) : row[column.key]}
+                </TableCell>
+              ))}
+            </TableRow>
+          ))}
+          {lastRow < rows.length && renderSpacer(rows.length - lastRow)}
+        </TableBody>
+      </Table>
+    </TableContainer>
+  );
+};
+
+export default VirtualizedTable;
@@ -1,29 +1,30 @@
-import { createSlice } from '@reduxjs/toolkit';
+import { createSlice, createEntityAdapter, createSelector } from '@reduxjs/toolkit';
 
-const initialState = {
-  customers: [],
+// Customers are stored normalized by id so edits are O(1) lookups
+const customersAdapter = createEntityAdapter();
+
+const initialState = customersAdapter.getInitialState({
   loading: false,
   error: null,
-};
+});
 
 const customerSlice = createSlice({
   name: 'customers',
   initialState,
   reducers: {
     setCustomers: (state, action) => {
-      state.customers = action.payload;
+      customersAdapter.setAll(state, action.payload);
     },
     addCustomer: (state, action) => {
-      state.customers.push(action.payload);
+      customersAdapter.addOne(state, action.payload);
     },
     updateCustomer: (state, action) => {
-      const index = state.customers.findIndex(customer => customer.id === action.payload.id);
-      if (index !== -1) {
-        state.customers[index] = action.payload;
+      if (state.entities[action.payload.id]) {
+        customersAdapter.setOne(state, action.payload);
       }
     },
     deleteCustomer: (state, action) => {
-      state.customers = state.customers.filter(customer => customer.id !== action.payload);
+      customersAdapter.removeOne(state, action.payload);
     },
     setLoading: (state, action) => {
       state.loading = action.payload;
@@ -43,4 +44,22 @@ export const {
   setError 
 } = customerSlice.actions;
 
+export const {
+  selectAll: selectAllCustomers,
+  selectById: selectCustomerById,
+  selectTotal: selectCustomerCount,
+} = customersAdapter.getSelectors((state) => state.customers);
+
+// Memoized search, only recomputed when the customers or the search term change
+export const selectFilteredCustomers = createSelector(
+  [selectAllCustomers, (state, searchTerm) => searchTerm],
+  (customers, searchTerm) => {
+    const searchTermLower = searchTerm.toLowerCase();
+    return customers.filter((customer) => (
+      customer.name.toLowerCase().includes(searchTermLower) ||
+      (customer.phone_number && customer.phone_number.includes(searchTerm))
+    ));
+  }
+);
+
 export default customerSlice.reducer; 
\ No newline at end of file
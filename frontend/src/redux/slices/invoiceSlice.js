@@ -1,29 +1,30 @@
-import { createSlice } from '@reduxjs/toolkit';
+import { createSlice, createEntityAdapter, createSelector } from '@reduxjs/toolkit';
 
-const initialState = {
-  invoices: [],
+// Invoices are stored normalized by id so edits are O(1) lookups
+const invoicesAdapter = createEntityAdapter();
+
+const initialState = invoicesAdapter.getInitialState({
   loading: false,
   error: null,
-};
+});
 
 const invoiceSlice = createSlice({
   name: 'invoices',
   initialState,
   reducers: {
     setInvoices: (state, action) => {
-      state.invoices = action.payload;
+      invoicesAdapter.setAll(state, action.payload);
     },
     addInvoice: (state, action) => {
-      state.invoices.push(action.payload);
+      invoicesAdapter.addOne(state, action.payload);
     },
     updateInvoice: (state, action) => {
-      const index = state.invoices.findIndex(invoice => invoice.id === action.payload.id);
-      if (index !== -1) {
-        state.invoices[index] = action.payload;
+      if (state.entities[action.payload.id]) {
+        invoicesAdapter.setOne(state, action.payload);
       }
     },
     deleteInvoice: (state, action) => {
-      state.invoices = state.invoices.filter(invoice => invoice.id !== action.payload);
+      invoicesAdapter.removeOne(state, action.payload);
     },
     setLoading: (state, action) => {
       state.loading = action.payload;
@@ -33,20 +34,18 @@ const invoiceSlice = createSlice({
     },
     updateInvoiceByProductId: (state, action) => {
       const { productId, productName } = action.payload;
-      state.invoices = state.invoices.map(invoice => {
-        if (invoice.product_id === productId) {
-          return { ...invoice, product_name: productName };
+      state.ids.forEach((id) => {
+        if (state.entities[id].product_id === productId) {
+          state.entities[id].product_name = productName;
         }
-        return invoice;
       });
     },
     updateInvoiceByCustomerId: (state, action) => {
       const { customerId, customerName } = action.payload;
-      state.invoices = state.invoices.map(invoice => {
-        if (invoice.customer_id === customerId) {
-          return { ...invoice, customer_name: customerName };
+      state.ids.forEach((id) => {
+        if (state.entities[id].customer_id === customerId) {
+          state.entities[id].customer_name = customerName;
         }
-        return invoice;
       });
     }
   },
@@ -63,4 +62,22 @@ export const {
   updateInvoiceByCustomerId
 } = invoiceSlice.actions;
 
+export const {
+  selectAll: selectAllInvoices,
+  selectTotal: selectInvoiceCount,
+} = invoicesAdapter.getSelectors((state) => state.invoices);
+
+// Memoized search, only recomputed when the invoices or the search term change
+export const selectFilteredInvoices = createSelector(
+  [selectAllInvoices, (state, searchTerm) => searchTerm],
+  (invoices, searchTerm) => {
+    const searchTermLower = searchTerm.toLowerCase();
+    return invoices.filter((invoice) => (
+      invoice.serial_number.toLowerCase().includes(searchTermLower) ||
+      invoice.customer_name.toLowerCase().includes(searchTermLower) ||
+      invoice.product_name.toLowerCase().includes(searchTermLower)
+    ));
+  }
+);
+
 export default invoiceSlice.reducer; 
\ No newline at end of file
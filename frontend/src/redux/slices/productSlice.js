@@ -1,29 +1,30 @@
-import { createSlice } from '@reduxjs/toolkit';
+import { createSlice, createEntityAdapter, createSelector } from '@reduxjs/toolkit';
 
-const initialState = {
-  products: [],
+// Products are stored normalized by id so edits are O(1) lookups
+const productsAdapter = createEntityAdapter();
+
+const initialState = productsAdapter.getInitialState({
   loading: false,
   error: null,
-};
+});
 
 const productSlice = createSlice({
   name: 'products',
   initialState,
   reducers: {
     setProducts: (state, action) => {
-      state.products = action.payload;
+      productsAdapter.setAll(state, action.payload);
     },
     addProduct: (state, action) => {
-      state.products.push(action.payload);
+      productsAdapter.addOne(state, action.payload);
     },
     updateProduct: (state, action) => {
-      const index = state.products.findIndex(product => product.id === action.payload.id);
-      if (index !== -1) {
-        state.products[index] = action.payload;
+      if (state.entities[action.payload.id]) {
+        productsAdapter.setOne(state, action.payload);
       }
     },
     deleteProduct: (state, action) => {
-      state.products = state.products.filter(product => product.id !== action.payload);
+      productsAdapter.removeOne(state, action.payload);
     },
     setLoading: (state, action) => {
       state.loading = action.payload;
@@ -43,4 +44,19 @@ export const {
   setError 
 } = productSlice.actions;
 
+export const {
+  selectAll: selectAllProducts,
+  selectById: selectProductById,
+  selectTotal: selectProductCount,
+} = productsAdapter.getSelectors((state) => state.products);
+
+// Memoized search, only recomputed when the products or the search term change
+export const selectFilteredProducts = createSelector(
+  [selectAllProducts, (state, searchTerm) => searchTerm],
+  (products, searchTerm) => {
+    const searchTermLower = searchTerm.toLowerCase();
+    return products.filter((product) => product.name.toLowerCase().includes(searchTermLower));
+  }
+);
+
 export default productSlice.reducer; 
\ No newline at end of file
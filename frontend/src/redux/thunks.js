@@ -1,12 +1,113 @@
 import axios from 'axios';
+import { Sha256 } from '../sha256';
 import { setInvoices, setLoading as setInvoicesLoading, setError as setInvoicesError } from './slices/invoiceSlice';
 import { setProducts, setLoading as setProductsLoading, setError as setProductsError } from './slices/productSlice';
 import { setCustomers, setLoading as setCustomersLoading, setError as setCustomersError } from './slices/customerSlice';
 
 const API_URL = 'http://localhost:8000/api';
 
-// Thunk for uploading and extracting data from files
-export const uploadAndExtractData = (file) => async (dispatch) => {
+// Files larger than this are sent in chunks of this size
+const CHUNK_SIZE = 5 * 1024 * 1024;
+
+// Times a request turned away with 429 is retried, waiting as long as the server's Retry-After asks
+const MAX_BUSY_RETRIES = 3;
+
+const withBusyRetry = async (request, onProgress) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await request();
+    } catch (error) {
+      if (error.response?.status !== 429 || attempt >= MAX_BUSY_RETRIES) throw error;
+      
+      const seconds = Number(error.response.headers['retry-after']) || 5;
+      onProgress({ stage: 'waiting', seconds });
+      await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+    }
+  }
+};
+
+// SHA-256 of the file bytes, the key the server stores extraction results under.
+// Read one slice at a time so large files never sit in memory whole
+const hashFile = async (file) => {
+  const hash = new Sha256();
+  for (let start = 0; start < file.size; start += CHUNK_SIZE) {
+    const slice = file.slice(start, Math.min(start + CHUNK_SIZE, file.size));
+    hash.update(new Uint8Array(await slice.arrayBuffer()));
+  }
+  return hash.hex();
+};
+
+// Look up a stored result for identical bytes, null when the file has to be uploaded
+const fetchStoredResult = async (hash) => {
+  try {
+    const response = await axios.get(`${API_URL}/results/${hash}`);
+    return response.data;
+  } catch (error) {
+    if (error.response?.status === 404) return null;
+    throw error;
+  }
+};
+
+// Send the file in one multipart request
+const uploadWhole = async (file, onProgress) => {
+  const formData = new FormData();
+  formData.append('file', file);
+  
+  const response = await withBusyRetry(() => axios.post(`${API_URL}/extract`, formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data',
+    },
+    onUploadProgress: (event) => {
+      if (event.total) onProgress({ stage: 'uploading', percent: Math.round((event.loaded * 100) / event.total) });
+    },
+  }), onProgress);
+  return response.data;
+};
+
+// Send the file in chunks, then ask the server to join and extract it
+const uploadInChunks = async (file, hash, onProgress) => {
+  const chunks = Math.ceil(file.size / CHUNK_SIZE);
+  
+  for (let index = 0; index < chunks; index++) {
+    const chunk = file.slice(index * CHUNK_SIZE, Math.min((index + 1) * CHUNK_SIZE, file.size));
+    await withBusyRetry(() => axios.put(`${API_URL}/uploads/${hash}/chunks/${index}`, chunk, {
+      headers: {
+        'Content-Type': 'application/octet-stream',
+      },
+      onUploadProgress: (event) => {
+        const loaded = index * CHUNK_SIZE + event.loaded;
+        onProgress({ stage: 'uploading', percent: Math.min(100, Math.round((loaded * 100) / file.size)) });
+      },
+    }), onProgress);
+  }
+  
+  onProgress({ stage: 'extracting' });
+  const response = await withBusyRetry(() => axios.post(`${API_URL}/uploads/${hash}/complete`, null, {
+    params: { filename: file.name, chunks },
+  }), onProgress);
+  return response.data;
+};
+
+// Send an invoice summary workbook and its item report together, the server joins them on serial number
+const uploadPaired = async (files, onProgress) => {
+  const formData = new FormData();
+  files.forEach((file) => formData.append('files', file));
+  
+  const response = await withBusyRetry(() => axios.post(`${API_URL}/extract/paired`, formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data',
+    },
+    onUploadProgress: (event) => {
+      if (!event.total) return;
+      const percent = Math.round((event.loaded * 100) / event.total);
+      onProgress(percent === 100 ? { stage: 'extracting' } : { stage: 'uploading', percent });
+    },
+  }), onProgress);
+  return response.data;
+};
+
+// Run an upload, putting its extracted data or error into all slices
+const extractInto = async (dispatch, fetchData) => {
   try {
     // Set loading state for all slices
     dispatch(setInvoicesLoading(true));
@@ -18,24 +119,15 @@ export const uploadAndExtractData = (file) => async (dispatch) => {
     dispatch(setProductsError(null));
     dispatch(setCustomersError(null));
     
-    // Create form data
-    const formData = new FormData();
-    formData.append('file', file);
-    
-    // Make API request
-    const response = await axios.post(`${API_URL}/extract`, formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data',
-      },
-    });
+    const data = await fetchData();
     
     // Update state with extracted data
-    dispatch(setInvoices(response.data.invoices));
-    dispatch(setProducts(response.data.products));
-    dispatch(setCustomers(response.data.customers));
+    dispatch(setInvoices(data.invoices));
+    dispatch(setProducts(data.products));
+    dispatch(setCustomers(data.customers));
     
     // Return validation errors if any
-    return response.data.validation_errors;
+    return data.validation_errors;
   } catch (error) {
     // Handle errors
     const errorMessage = error.response?.data?.detail || 'Error extracting data from file';
@@ -49,4 +141,31 @@ export const uploadAndExtractData = (file) => async (dispatch) => {
     dispatch(setProductsLoading(false));
     dispatch(setCustomersLoading(false));
   }
-}; 
\ No newline at end of file
+};
+
+// Thunk for uploading and extracting data from files
+//
+// The file is hashed first; if the server already extracted the same bytes
+// the stored result is used and nothing is uploaded. onProgress receives
+// { stage, percent } updates for the upload indicator.
+export const uploadAndExtractData = (file, onProgress = () => {}) => (dispatch) => extractInto(dispatch, async () => {
+  onProgress({ stage: 'hashing' });
+  const hash = await hashFile(file);
+  
+  const data = await fetchStoredResult(hash);
+  if (data) return data;
+  
+  onProgress({ stage: 'uploading', percent: 0 });
+  if (file.size > CHUNK_SIZE) {
+    return uploadInChunks(file, hash, onProgress);
+  }
+  return uploadWhole(file, (progress) => {
+    onProgress(progress.percent === 100 ? { stage: 'extracting' } : progress);
+  });
+});
+
+// Thunk for an invoice summary workbook dropped together with its item report
+export const uploadAndExtractPairedData = (files, onProgress = () => {}) => (dispatch) => extractInto(dispatch, () => {
+  onProgress({ stage: 'uploading', percent: 0 });
+  return uploadPaired(files, onProgress);
+});